@@ -1,4 +1,8 @@
+import multiprocessing
+
 from .main import main
 
 if __name__ == "__main__":
+    # Needed by the CSV reader process pool in frozen executables
+    multiprocessing.freeze_support()
     main()
@@ -1 +1,9 @@
-__all__ = ['filters', 'waveform']
+__all__ = [
+    'align',
+    'expressions',
+    'filters',
+    'pipeline',
+    'segments',
+    'spectrum',
+    'waveform',
+]
@@ -0,0 +1,41 @@
+import numpy as np
+
+Timebases = ['Fastest curve', 'Slowest curve', 'Explicit rate']
+
+
+def commonSpan(sers):
+    # Time range covered by all the series
+    begin = max(s.index[0] for s in sers)
+    end = min(s.index[-1] for s in sers)
+    return (begin, end)
+
+
+def timebase(sers, samplerates, choice, rate=None):
+    # Timestamps to evaluate the series on within their common span, along
+    # with their sample rate
+    begin, end = commonSpan(sers)
+    if end < begin:
+        return (np.array([], dtype=np.int64), rate)
+    if choice == 'Explicit rate':
+        step = 1e9 / rate  # Hz to ns
+        nsteps = int((end - begin) // step) + 1
+        index = begin + np.round(np.arange(nsteps) * step).astype(np.int64)
+        return (index, rate)
+    pick = np.argmax if choice == 'Fastest curve' else np.argmin
+    n = pick(samplerates)
+    index = sers[n].index.values
+    first = np.searchsorted(index, begin)
+    last = np.searchsorted(index, end, side='right')
+    return (index[first:last], samplerates[n])
+
+
+def valuesAt(series, index):
+    # Linear interpolation in time of series at index, NaN outside of it.
+    # Timestamps are made relative to the first one so that the conversion
+    # to float keeps ns precision.
+    if len(index) < 1:
+        return np.array([])
+    origin = index[0]
+    x = (index - origin).astype(np.float64)
+    xp = (series.index.values - origin).astype(np.float64)
+    return np.interp(x, xp, series.values, left=np.nan, right=np.nan)
@@ -0,0 +1,76 @@
+import time
+from functools import lru_cache
+
+import numpy as np
+from sympy import Symbol, lambdify
+from sympy.parsing.sympy_parser import (
+    convert_xor,
+    parse_expr,
+    standard_transformations,
+)
+
+# Expressions are evaluated by chunks of CHUNKSIZE samples so that the
+# temporaries stay small whatever the length of the curves.
+CHUNKSIZE = 2 ** 14
+MAXCOMPILED = 256
+
+
+class CompiledExpression:
+    def __init__(self, expr, symbols, func, compiletime):
+        self.expr = expr
+        # Symbol names, in argument order
+        self.symbols = symbols
+        self.func = func
+        self.compiletime = compiletime
+        self.evaltime = 0
+
+    def __call__(self, *args, chunksize=CHUNKSIZE):
+        start = time.perf_counter()
+        values = evaluate(self.func, args, chunksize)
+        self.evaltime = time.perf_counter() - start
+        return values
+
+    def timings(self):
+        compilems = 1e3 * self.compiletime
+        evalms = 1e3 * self.evaltime
+        return f'compiled in {compilems:.1f} ms, evaluated in {evalms:.1f} ms'
+
+
+def compileExpression(formula, symbols=None, convertxor=True):
+    # symbols are the argument names, all the free symbols sorted by name if
+    # None. convertxor reads ^ as a power like sympify does.
+    formula = ' '.join(formula.split())
+    if symbols is not None:
+        symbols = tuple(symbols)
+    return cachedCompile(formula, symbols, convertxor)
+
+
+@lru_cache(maxsize=MAXCOMPILED)
+def cachedCompile(formula, symbols, convertxor):
+    start = time.perf_counter()
+    transformations = standard_transformations
+    if convertxor:
+        transformations += (convert_xor,)
+    expr = parse_expr(formula, transformations=transformations)
+    if symbols is None:
+        symbols = tuple(sorted(str(s) for s in expr.free_symbols))
+    func = cachedLambdify(expr, symbols)
+    return CompiledExpression(expr, symbols, func, time.perf_counter() - start)
+
+
+@lru_cache(maxsize=MAXCOMPILED)
+def cachedLambdify(expr, symbols):
+    # Formulas written differently that parse to the same expression share
+    # their function
+    return lambdify([Symbol(s) for s in symbols], expr, 'numpy')
+
+
+def evaluate(func, args, chunksize=CHUNKSIZE):
+    # func applied elementwise to the equal length arrays args
+    args = [np.asarray(arg) for arg in args]
+    nvalues = len(args[0]) if args else 1
+    values = np.empty(nvalues)
+    for start in range(0, nvalues, chunksize):
+        chunks = [arg[start : start + chunksize] for arg in args]
+        values[start : start + chunksize] = func(*chunks)
+    return values
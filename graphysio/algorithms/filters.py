@@ -1,11 +1,14 @@
 from datetime import datetime
-from math import ceil
+from fractions import Fraction
+from functools import lru_cache
 from typing import Dict
 
 import numpy as np
 import pandas as pd
 from scipy import interpolate, signal
 
+from graphysio.algorithms import expressions
+from graphysio.algorithms.segments import Segments
 from graphysio.structures import Filter, Parameter
 from graphysio.utils import truncatevecs
 
@@ -15,14 +18,66 @@ class TF(object):
         self.num = num
         self.den = den
         self.name = name
+        self.sosdesigns = {}
 
     def discretize(self, samplerate):
         systf = (self.num, self.den)
         (dnum, dden, _) = signal.cont2discrete(systf, 1 / samplerate)
         return (np.squeeze(dnum), np.squeeze(dden))
 
-
-interpkind = ['linear', 'nearest', 'zero', 'slinear', 'quadratic', 'cubic']
+    def sos(self, samplerate):
+        # Second-order sections of the discretized transfer function
+        if samplerate not in self.sosdesigns:
+            b, a = self.discretize(samplerate)
+            b, a = np.atleast_1d(b), np.atleast_1d(a)
+            # Leading zeros of the numerator are a pure delay which tf2sos
+            # would drop, add it back as z^-1 sections.
+            trimmed = np.trim_zeros(b, 'f')
+            delay = len(b) - len(trimmed)
+            sos = signal.tf2sos(np.pad(trimmed, (0, delay)), a)
+            delays = [[0, 1, 0, 1, 0, 0]] * delay
+            self.sosdesigns[samplerate] = np.vstack([sos] + delays)
+        return self.sosdesigns[samplerate]
+
+
+# Long signals are filtered by blocks of FILTERBLOCK samples, carrying the
+# filter state over from one block to the next.
+FILTERBLOCK = 2 ** 20
+
+
+@lru_cache(maxsize=64)
+def butterSos(order, Wn, btype='lowpass'):
+    # Wn is a float or a tuple so that designs can be memoized
+    return signal.butter(order, Wn, btype=btype, output='sos')
+
+
+def sosfiltBlocks(sos, blocks):
+    # Causal filtering of the consecutive blocks of one signal
+    zi = np.zeros((sos.shape[0], 2))
+    for block in blocks:
+        filtered, zi = signal.sosfilt(sos, block, zi=zi)
+        yield filtered
+
+
+def sosfilt(sos, values, blocksize=FILTERBLOCK):
+    filtered = np.empty(len(values))
+    starts = range(0, len(values), blocksize)
+    blocks = (values[start : start + blocksize] for start in starts)
+    for start, block in zip(starts, sosfiltBlocks(sos, blocks)):
+        filtered[start : start + len(block)] = block
+    return filtered
+
+
+interpkind = [
+    'linear',
+    'nearest',
+    'zero',
+    'slinear',
+    'quadratic',
+    'cubic',
+    'polyphase',
+    'fft',
+]
 Filters = {
     'Lowpass filter': Filter(
         name='lowpass',
@@ -72,7 +127,11 @@ Filters = {
         ],
     ),
     'Strided Moving average': Filter(
-        name='sma', parameters=[Parameter('Window duration', 'time')]
+        name='sma',
+        parameters=[
+            Parameter('Window duration', 'time'),
+            Parameter('Step between windows (empty for window duration)', 'time'),
+        ],
     ),
     'Affine scale': Filter(
         name='affine',
@@ -115,16 +174,10 @@ def norm2(series, samplerate, parameters):
     return (series.rename(newname), samplerate)
 
 
-from sympy import lambdify
-from sympy.abc import x
-from sympy.parsing.sympy_parser import parse_expr
-
-
 def expression(series, samplerate, parameters):
     (express,) = parameters
-    expr = parse_expr(express)
-    f = lambdify(x, expr, 'numpy')
-    filtered = f(series.values)
+    compiled = expressions.compileExpression(express, ['x'], convertxor=False)
+    filtered = compiled(series.values)
     newname = f'{series.name}-filtered'
     newseries = pd.Series(filtered, index=series.index, name=newname)
     return (newseries, samplerate)
@@ -139,31 +192,92 @@ def setdatetime(series, samplerate, parameters):
     return (newseries, samplerate)
 
 
+def cumulative(values):
+    # Cumulative sum from 0 of the values taken relative to the first one, to
+    # limit rounding errors, with NaN counted as 0. Also returns the
+    # reference value and the cumulative count of NaN, None if there is none.
+    ref = values[0] if len(values) > 0 and np.isfinite(values[0]) else 0
+    cs = np.zeros(len(values) + 1)
+    np.subtract(values, ref, out=cs[1:])
+    isnan = np.isnan(cs[1:])
+    nancs = None
+    if isnan.any():
+        cs[1:][isnan] = 0
+        nancs = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum(isnan, out=nancs[1:])
+    np.cumsum(cs[1:], out=cs[1:])
+    return (ref, cs, nancs)
+
+
+def windowSums(values, starts, stops):
+    # Sums of values[start:stop], NaN for windows with NaN
+    ref, cs, nancs = cumulative(values)
+    sums = cs[stops] - cs[starts] + ref * (stops - starts)
+    if nancs is not None:
+        sums[nancs[stops] > nancs[starts]] = np.nan
+    return sums
+
+
+def rollingSums(values, window):
+    # Sums of all the windows of consecutive samples, NaN for windows with NaN
+    ref, cs, nancs = cumulative(values)
+    sums = cs[window:] - cs[:-window]
+    sums += ref * window
+    if nancs is not None:
+        sums[nancs[window:] > nancs[:-window]] = np.nan
+    return sums
+
+
+def windowMeans(values, winsize, hop):
+    # Means of windows of winsize samples every hop samples, the last window
+    # being partial if the samples do not fill it. Returns the window starts,
+    # stops and means.
+    nvalues = len(values)
+    nfull = (nvalues - winsize) // hop + 1 if nvalues >= winsize else 0
+    starts = np.arange(nfull) * hop
+    if nfull < 1 or starts[-1] + winsize < nvalues:
+        # Trailing partial window
+        starts = np.append(starts, nfull * hop)
+    starts = starts[starts < nvalues]
+    stops = np.minimum(starts + winsize, nvalues)
+    if hop == winsize and nfull > 0:
+        full = values[: nfull * winsize].reshape(nfull, winsize).mean(axis=1)
+        partial = [values[start:].mean() for start in starts[nfull:]]
+        means = np.concatenate([full, partial])
+    else:
+        means = windowSums(values, starts, stops) / (stops - starts)
+    return (starts, stops, means)
+
+
 def sma(series, samplerate, parameters):
-    (window_s,) = parameters
-    serarr = series.to_numpy()
-    serlen = len(serarr)
-    winsize = int(window_s * samplerate)
-    nwindows = ceil(serlen / winsize)
-    valstarts = np.arange(0, serlen - winsize, step=winsize)
-    resiter = (
-        np.mean(serarr[beg:end]) for beg, end in zip(valstarts, valstarts + winsize)
-    )
-    result = np.fromiter(resiter, dtype=np.float64)
-    locidx = winsize * np.arange(0, nwindows - 1) + winsize // 2
+    window_s, hop_s = parameters
+    serarr = series.to_numpy(dtype=np.float64)
+    winsize = max(int(window_s * samplerate), 1)
+    hop = int(hop_s * samplerate) if hop_s else winsize
+    hop = max(hop, 1)
+    starts, stops, result = windowMeans(serarr, winsize, hop)
+    # Timestamp in the middle of the samples of each window
+    index = series.index.values
+    first, last = index[starts], index[stops - 1]
+    newindex = first + (last - first) // 2
     newname = f'{series.name}-sma{window_s}s'
-    newseries = pd.Series(result, index=series.index[locidx], name=newname)
-    newsamplerate = samplerate / winsize
+    newseries = pd.Series(result, index=newindex, name=newname)
+    newsamplerate = samplerate / hop
     return (newseries, newsamplerate)
 
 
-def savgol(series, samplerate, parameters):
-    window, order = parameters
-    window = np.floor(window * samplerate)
+def savgolWindow(window, samplerate):
+    window = int(np.floor(window * samplerate))
     if not window % 2:
         # window is even, we need odd
         window += 1
-    filtered = signal.savgol_filter(series.values, int(window), order)
+    return window
+
+
+def savgol(series, samplerate, parameters):
+    window, order = parameters
+    window = savgolWindow(window, samplerate)
+    filtered = signal.savgol_filter(series.values, window, order)
     newname = f'{series.name}-filtered'
     newseries = pd.Series(filtered, index=series.index, name=newname)
     return (newseries, samplerate)
@@ -185,48 +299,172 @@ def affine(series, samplerate, parameters):
     return (newseries, samplerate)
 
 
+def sosDesign(filtname, samplerate, parameters):
+    # Second-order sections and name suffix of the filters of BLOCKWISE
+    if filtname == 'tf':
+        (tfname,) = parameters
+        tf = TFs[tfname]
+        return (tf.sos(samplerate), tf.name)
+    Fc, order = parameters
+    return (butterSos(order, Fc * 2 / samplerate), f'lp{Fc}')
+
+
 def tf(series, samplerate, parameters):
-    (filtname,) = parameters
-    tf = TFs[filtname]
-    b, a = tf.discretize(samplerate)
-    filtered = signal.lfilter(b, a, series)
-    newname = f'{series.name}-{tf.name}'
+    sos, suffix = sosDesign('tf', samplerate, parameters)
+    filtered = sosfilt(sos, series.values)
+    newname = f'{series.name}-{suffix}'
     newseries = pd.Series(filtered, index=series.index, name=newname)
     return (newseries, samplerate)
 
 
 def lowpass(series, samplerate, parameters):
-    Fc, order = parameters
-    Wn = Fc * 2 / samplerate
-    b, a = signal.butter(order, Wn)
-    filtered = signal.lfilter(b, a, series)
-    newname = f'{series.name}-lp{Fc}'
+    sos, suffix = sosDesign('lowpass', samplerate, parameters)
+    filtered = sosfilt(sos, series.values)
+    newname = f'{series.name}-{suffix}'
     newseries = pd.Series(filtered, index=series.index, name=newname)
     return (newseries, samplerate)
 
 
-def ventilation(series, samplerate, parameters):
+def filterSource(source, filtname, parameters):
+    # Filter of BLOCKWISE on a windowed source such as readdata.edf.EdfSource,
+    # decoded one block at a time instead of loaded whole
+    samplerate = source.samplerate
+    sos, suffix = sosDesign(filtname, samplerate, parameters)
+    filtered = np.empty(len(source))
+    start = 0
+    for block in sosfiltBlocks(sos, source.iterBlocks()):
+        filtered[start : start + len(block)] = block
+        start += len(block)
+    index = source.timestamps(np.arange(len(source)))
+    newname = f'{source.name}-{suffix}'
+    newseries = pd.Series(filtered, index=index, name=newname)
+    return (newseries, samplerate)
+
+
+def ventilationSos(samplerate):
     order = 12
     # Filter between 10 and 20 per minute
     bornes_hz = np.array([10, 20]) / 60
-    Wn = [Fc * 2 / samplerate for Fc in bornes_hz]
-    b, a = signal.butter(order, Wn, btype='bandstop')
-    filtered = signal.filtfilt(b, a, series.values)
+    Wn = tuple(Fc * 2 / samplerate for Fc in bornes_hz)
+    return butterSos(order, Wn, btype='bandstop')
+
+
+def filtfiltPadlen(sos):
+    # Edge padding of signal.sosfiltfilt, the signal must be longer
+    ntaps = 2 * len(sos) + 1
+    ntaps -= min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+    return 3 * ntaps
+
+
+def ventilation(series, samplerate, parameters):
+    sos = ventilationSos(samplerate)
+    filtered = signal.sosfiltfilt(sos, series.values)
     newname = f'{series.name}-novent'
     newseries = pd.Series(filtered, index=series.index, name=newname)
     return (newseries, samplerate)
 
 
-def interp(series, samplerate, parameters):
-    newsamplerate, method = parameters
-    oldidx = series.index
+# Resampling of uniformly sampled curves uses rate ratios up / down with the
+# smaller of up and down at most MAXDENOMINATOR. It falls back to FFT
+# resampling if no such ratio is within RATETOLERANCE of the actual one, or if
+# the larger is above MAXFACTOR as the polyphase filter grows with it. Other
+# curves are interpolated by chunks of INTERPCHUNK new samples, from the source
+# samples they span plus INTERPMARGIN on each side.
+MAXDENOMINATOR = 1000
+RATETOLERANCE = 1e-4
+MAXFACTOR = 2 ** 16
+INTERPCHUNK = 2 ** 16
+INTERPMARGIN = 32
+
+
+def isUniform(index, tolerance=0.01):
+    if len(index) < 2:
+        return False
+    intervals = np.diff(index)
+    period = np.median(intervals)
+    return period > 0 and np.all(np.abs(intervals - period) <= tolerance * period)
+
+
+def rateRatio(ratio):
+    # Integers up and down with up / down close to ratio
+    if ratio >= 1:
+        approx = Fraction(ratio).limit_denominator(MAXDENOMINATOR)
+        return (approx.numerator, approx.denominator)
+    approx = Fraction(1 / ratio).limit_denominator(MAXDENOMINATOR)
+    return (approx.denominator, approx.numerator)
+
+
+def polyphase(values, begin, period, newsamplerate):
+    # Returns the new index, values and actual sample rate
+    ratio = newsamplerate * period / 1e9
+    up, down = rateRatio(ratio)
+    if abs(up / down - ratio) > RATETOLERANCE * ratio or max(up, down) > MAXFACTOR:
+        return fftResample(values, begin, period, newsamplerate)
+    resampled = signal.resample_poly(values, up, down)
+    newperiod = period * down / up
+    newindex = begin + np.round(np.arange(len(resampled)) * newperiod)
+    return (newindex.astype(np.int64), resampled, 1e9 / newperiod)
+
+
+def fftResample(values, begin, period, newsamplerate):
+    nvalues = max(int(round(len(values) * newsamplerate * period / 1e9)), 1)
+    resampled = signal.resample(values, nvalues)
+    newperiod = period * len(values) / nvalues
+    newindex = begin + np.round(np.arange(nvalues) * newperiod)
+    return (newindex.astype(np.int64), resampled, 1e9 / newperiod)
+
+
+def interpChunk(x, y, newx, kind):
+    minpoints = {'quadratic': 3, 'cubic': 4}.get(kind, 2)
+    if kind == 'linear' or len(x) < minpoints:
+        return np.interp(newx, x, y)
     f = interpolate.interp1d(
-        oldidx, series.values, kind=method, fill_value='extrapolate'
+        x, y, kind=kind, assume_sorted=True, fill_value='extrapolate'
     )
-    step = 1e9 / newsamplerate  # 1e9 to convert Hz to ns
-    newidx = np.arange(oldidx[0], oldidx[-1], step, dtype=np.int64)
-    resampled = f(newidx)
+    return f(newx)
+
+
+def gapInterp(index, values, newindex, kind):
+    # Interpolation of the finite values at newindex, NaN within gaps
+    finite = np.isfinite(values)
+    index, values = index[finite], values[finite]
+    result = np.full(len(newindex), np.nan)
+    if len(index) < 1:
+        return result
+    for segstart, segstop in Segments.fromIndex(index):
+        first = np.searchsorted(newindex, index[segstart])
+        last = np.searchsorted(newindex, index[segstop - 1], side='right')
+        for start in range(first, last, INTERPCHUNK):
+            stop = min(start + INTERPCHUNK, last)
+            lo = np.searchsorted(index, newindex[start]) - INTERPMARGIN
+            hi = np.searchsorted(index, newindex[stop - 1]) + INTERPMARGIN
+            lo, hi = max(lo, segstart), min(hi, segstop)
+            # Relative timestamps keep ns precision as float
+            origin = index[lo]
+            x = (index[lo:hi] - origin).astype(np.float64)
+            newx = (newindex[start:stop] - origin).astype(np.float64)
+            result[start:stop] = interpChunk(x, values[lo:hi], newx, kind)
+    return result
+
+
+def interp(series, samplerate, parameters):
+    newsamplerate, method = parameters
+    oldidx = series.index.values
+    values = series.to_numpy(dtype=np.float64)
     newname = f'{series.name}-{newsamplerate}Hz'
+    resample = {'polyphase': polyphase, 'fft': fftResample}.get(method)
+    if resample is not None and isUniform(oldidx) and np.isfinite(values).all():
+        period = (oldidx[-1] - oldidx[0]) / (len(oldidx) - 1)
+        newidx, resampled, newsamplerate = resample(
+            values, oldidx[0], period, newsamplerate
+        )
+    else:
+        # Irregular timestamps or gaps, fall back to linear interpolation
+        kind = 'linear' if resample is not None else method
+        step = 1e9 / newsamplerate  # 1e9 to convert Hz to ns
+        nsteps = int(np.ceil((oldidx[-1] - oldidx[0]) / step))
+        newidx = oldidx[0] + (np.arange(nsteps) * step).astype(np.int64)
+        resampled = gapInterp(oldidx, values, newidx, kind)
     newseries = pd.Series(resampled, index=newidx, name=newname)
     return (newseries, newsamplerate)
 
@@ -243,9 +481,14 @@ def dopplercut(series, samplerate, parameters):
 def integrate(series, samplerate, parameters):
     (duration,) = parameters
     window = int(np.floor(duration * samplerate))
-    integrated = series.rolling(window, center=True).sum()
+    # Centred rolling sum, NaN where the window is incomplete
+    values = series.to_numpy(dtype=np.float64)
+    integrated = np.full(len(values), np.nan)
+    if 0 < window <= len(values):
+        sums = rollingSums(values, window)
+        integrated[window // 2 : window // 2 + len(sums)] = sums
     newname = f'{series.name}-integrate{duration}s'
-    newseries = integrated.rename(newname)
+    newseries = pd.Series(integrated, index=series.index, name=newname)
     return (newseries, samplerate)
 
 
@@ -292,13 +535,40 @@ filtfuncs = {
     'fillnan': fillnan,
 }
 
+# Filters whose output at a sample depends on its neighbours. They are run on
+# each segment of the curve separately so as not to filter across gaps.
+SEGMENTWISE = {
+    'savgol',
+    'tf',
+    'sma',
+    'lowpass',
+    'ventilation',
+    'interp',
+    'integrate',
+    'diff',
+}
+
+# Causal filters whose state carries over from one block to the next. They
+# can run on lazy sources by blocks, see filterSource.
+BLOCKWISE = {'tf', 'lowpass'}
+
+
+def minSamples(filtname, samplerate, parameters):
+    # Shortest segment the filter can process. Shorter segments are left out
+    # of the result by segments.apply.
+    if filtname == 'savgol':
+        window, _ = parameters
+        return savgolWindow(window, samplerate)
+    if filtname == 'ventilation':
+        return filtfiltPadlen(ventilationSos(samplerate)) + 1
+    return 1
 
-def filter(curve, filtname, paramgetter):
-    samplerate = curve.samplerate
-    series = curve.series
+
+def askStep(filtname, paramgetter):
+    # Pipeline step for the filter, see algorithms.pipeline
     filt = Filters[filtname]
-    parameters = map(paramgetter, filt.parameters)
-    return filtfuncs[filt.name](series, samplerate, parameters)
+    parameters = tuple(map(paramgetter, filt.parameters))
+    return (filt.name, parameters)
 
 
 def filterFeet(starts, stops, filtname, paramgetter):
@@ -0,0 +1,206 @@
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from graphysio.algorithms import filters, segments
+from graphysio.algorithms.segments import Segments
+
+# Size of the intermediate results kept per pipeline
+MAXCACHE = 2 ** 28  # bytes
+
+# Steps computed on the values alone, run together on a single buffer. The
+# rename step only sets the name, e.g. after a curve was filtered in place.
+ELEMENTWISE = {'affine', 'norm1', 'norm2', 'dopplercut', 'rename'}
+# Steps that leave the data as is. Their result shares the arrays of the
+# previous one and is not cached.
+NAMEONLY = {'rename'}
+
+
+class Pipeline:
+    # Runs lists of (filter name, parameters) steps on the data of a curve,
+    # with filter names as in filters.filtfuncs. Results are cached by step
+    # prefix, so changing the end of a chain only recomputes from there.
+    # segments of the source series are found from its index if None. series
+    # can also be a windowed source such as readdata.edf.EdfSource, which is
+    # filtered by blocks if the first step allows it and loaded whole otherwise.
+    def __init__(self, series, samplerate, segments=None, maxcache=MAXCACHE):
+        self.lazy = None
+        self.source = None
+        if isinstance(series, pd.Series):
+            self.source = seriesState(series, samplerate)
+        else:
+            self.lazy = series
+        self.segments = segments
+        self.maxcache = maxcache
+        self.cache = OrderedDict()
+        self.cachebytes = 0
+
+    def run(self, steps):
+        steps = tuple((name, tuple(parameters)) for name, parameters in steps)
+        state = self.source
+        ndone = 0
+        for n in range(len(steps), 0, -1):
+            if steps[:n] in self.cache:
+                self.cache.move_to_end(steps[:n])
+                state = self.cache[steps[:n]]
+                ndone = n
+                break
+        for group in groupSteps(steps[ndone:]):
+            if state is None:
+                state = self.runSource(group)
+            else:
+                segs = self.segments if state is self.source else None
+                state = runGroup(state, group, segs)
+            ndone += len(group)
+            if not nameOnly(group):
+                self.store(steps[:ndone], state)
+        if state is None:
+            state = self.load()
+        index, values, samplerate, name = state
+        return (pd.Series(values, index=index, name=name), samplerate)
+
+    def runSource(self, group):
+        # First steps on a lazy source
+        stepname, parameters = group[0]
+        if len(group) == 1 and stepname in filters.BLOCKWISE:
+            newseries, samplerate = filters.filterSource(
+                self.lazy, stepname, parameters
+            )
+            return seriesState(newseries, samplerate)
+        return runGroup(self.load(), group, self.segments)
+
+    def load(self):
+        self.source = seriesState(self.lazy.series(), self.lazy.samplerate)
+        self.lazy = None
+        return self.source
+
+    def store(self, steps, state):
+        self.cache[steps] = state
+        self.cachebytes += stateBytes(state)
+        while self.cachebytes > self.maxcache and len(self.cache) > 1:
+            _, old = self.cache.popitem(last=False)
+            self.cachebytes -= stateBytes(old)
+
+
+def seriesState(series, samplerate):
+    return (series.index.values, series.values, samplerate, series.name)
+
+
+def stateBytes(state):
+    index, values, _, _ = state
+    return index.nbytes + values.nbytes
+
+
+def nameOnly(group):
+    return all(stepname in NAMEONLY for stepname, _ in group)
+
+
+def groupSteps(steps):
+    # Consecutive elementwise steps are grouped. The last step is always on
+    # its own so that the result before it is cached.
+    groups = []
+    for n, step in enumerate(steps):
+        name, _ = step
+        fusable = name in ELEMENTWISE and n < len(steps) - 1
+        if fusable and groups and groups[-1][-1][0] in ELEMENTWISE:
+            groups[-1].append(step)
+        else:
+            groups.append([step])
+    return groups
+
+
+def runGroup(state, group, segs=None):
+    index, values, samplerate, name = state
+    stepname, parameters = group[0]
+    if stepname in ELEMENTWISE:
+        if not nameOnly(group):
+            values = runElementwise(values, group)
+        for stepname, parameters in group:
+            name = elementwiseName(name, stepname, parameters)
+        return (index, values, samplerate, name)
+    series = pd.Series(values, index=index, name=name)
+    filtfunc = filters.filtfuncs[stepname]
+    if stepname in filters.SEGMENTWISE:
+        if segs is None:
+            segs = Segments.fromIndex(index)
+        minsamples = filters.minSamples(stepname, samplerate, parameters)
+        newseries, samplerate = segments.apply(
+            filtfunc, series, samplerate, parameters, segs, minsamples
+        )
+    else:
+        newseries, samplerate = filtfunc(series, samplerate, iter(parameters))
+    return (newseries.index.values, newseries.values, samplerate, newseries.name)
+
+
+def runElementwise(values, steps):
+    # Chains of affine maps, including the normalizations whose coefficients
+    # follow from the statistics of their input, are composed into a single
+    # multiply-add. Thresholds apply the pending map first. values is never
+    # modified.
+    current = values
+    out = None
+    scale, offset = 1.0, 0.0
+    for stepname, parameters in steps:
+        if stepname == 'affine':
+            a, b = parameters
+            scale, offset = a * scale, a * offset + b
+        elif stepname == 'norm1':
+            mean = np.nanmean(current) * scale + offset
+            span = (np.nanmax(current) - np.nanmin(current)) * abs(scale)
+            scale, offset = scale / span, (offset - mean) / span
+        elif stepname == 'norm2':
+            mean = np.nanmean(current) * scale + offset
+            std = np.nanstd(current) * abs(scale)
+            scale, offset = scale / std, (offset - mean) / std
+        elif stepname == 'dopplercut':
+            (minvel,) = parameters
+            if out is None:
+                out = np.empty(len(values))
+            current = np.multiply(current, scale, out=out)
+            current += offset
+            scale, offset = 1.0, 0.0
+            current[current < minvel] = 0
+    if out is None:
+        out = np.empty(len(values))
+    current = np.multiply(current, scale, out=out)
+    current += offset
+    return current
+
+
+def elementwiseName(name, stepname, parameters):
+    # Same names as the filters of filters.filtfuncs
+    if stepname == 'affine':
+        a, b = parameters
+        return f'{name}-affine-{a}-{b}'
+    if stepname in ('norm1', 'norm2'):
+        return f'{name}-norm'
+    if stepname == 'rename':
+        (newname,) = parameters
+        return newname
+    (minvel,) = parameters
+    return f'{name}-{minvel}+'
+
+
+def forCurve(curve):
+    # Pipeline and steps that produced the data of curve. Start over from
+    # the current data if it was changed by other means since.
+    source = getattr(curve, 'source', None)
+    if source is not None:
+        # Lazy curve, not loaded so far
+        return (Pipeline(source, curve.samplerate), [])
+    state = getattr(curve, 'pipeline', None)
+    if state is not None:
+        pipeline, steps, series, index = state
+        if curve.series is series and series.index is index:
+            return (pipeline, steps)
+    return (Pipeline(curve.series, curve.samplerate, curve.segments), [])
+
+
+def attach(curve, pipeline, steps):
+    curve.pipeline = (pipeline, steps, curve.series, curve.series.index)
+
+
+def detach(curve):
+    # Release the source and intermediate results held for curve
+    curve.pipeline = None
@@ -0,0 +1,112 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Intervals longer than GAPFACTOR times the median one are gaps between
+# segments, e.g. monitor disconnections
+GAPFACTOR = 4
+
+executor = None
+
+
+def getExecutor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor()
+    return executor
+
+
+class Segments:
+    # Contiguous, uniformly sampled runs [start, stop) of sample positions of
+    # a series, separated by gaps
+    def __init__(self, starts, stops, period):
+        self.starts = starts
+        self.stops = stops
+        # Median interval in ns
+        self.period = period
+
+    @classmethod
+    def fromIndex(cls, index, gapfactor=GAPFACTOR):
+        nsamples = len(index)
+        if nsamples < 2:
+            starts = np.zeros(min(nsamples, 1), dtype=np.int64)
+            return cls(starts, starts + nsamples, 0)
+        intervals = np.diff(index)
+        period = np.median(intervals)
+        (gaps,) = (intervals > gapfactor * period).nonzero()
+        starts = np.concatenate([[0], gaps + 1])
+        stops = np.concatenate([gaps + 1, [nsamples]])
+        return cls(starts, stops, period)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return zip(self.starts, self.stops)
+
+    def split(self, series):
+        return [series.iloc[start:stop] for start, stop in self]
+
+
+def apply(filtfunc, series, samplerate, parameters, segments, minsamples=1):
+    # Run a filter of filters.filtfuncs on every segment in the thread pool
+    # and join the results. Segments of less than minsamples samples, too
+    # short for the filter, are left out.
+    parameters = list(parameters)
+    if len(segments) < 2:
+        return filtfunc(series, samplerate, iter(parameters))
+    parts = [part for part in segments.split(series) if len(part) >= minsamples]
+    if not parts:
+        raise ValueError(f'No segment of at least {minsamples} samples')
+    results = list(
+        getExecutor().map(
+            lambda part: filtfunc(part, samplerate, iter(parameters)), parts
+        )
+    )
+    newseries = pd.concat([newseries for newseries, _ in results])
+    _, newsamplerate = results[0]
+    return (newseries, newsamplerate)
+
+
+class UniformView:
+    # Series with gaps seen as a uniformly sampled signal where the gaps are
+    # NaN, read by blocks like readdata.edf.EdfSource
+    def __init__(self, series, segments, samplerate):
+        self.series = series
+        self.segments = segments
+        self.name = series.name
+        self.samplerate = samplerate
+        index = series.index.values
+        self.begin = index[0]
+        self.period = 1e9 / samplerate
+        # Position of the segment starts on the uniform grid
+        offsets = (index[segments.starts] - self.begin) / self.period
+        self.offsets = np.round(offsets).astype(np.int64)
+        lengths = segments.stops - segments.starts
+        self.nsamples = int(self.offsets[-1] + lengths[-1])
+
+    def __len__(self):
+        return self.nsamples
+
+    def timestamps(self, positions):
+        positions = np.asarray(positions)
+        return self.begin + np.round(positions * self.period).astype(np.int64)
+
+    def read(self, start, stop):
+        start = max(start, 0)
+        stop = min(stop, self.nsamples)
+        values = np.full(max(stop - start, 0), np.nan)
+        segstarts, segstops = self.segments.starts, self.segments.stops
+        first = max(np.searchsorted(self.offsets, start, side='right') - 1, 0)
+        last = np.searchsorted(self.offsets, stop)
+        source = self.series.values
+        for n in range(first, last):
+            offset = self.offsets[n]
+            lo = max(start, offset)
+            hi = min(stop, offset + segstops[n] - segstarts[n])
+            if hi <= lo:
+                continue
+            pos = segstarts[n] + lo - offset
+            values[lo - start : hi - start] = source[pos : pos + hi - lo]
+        return values
@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+
+# Number of PSD columns computed at once
+BATCHSIZE = 1024
+
+# A signal is an array, a pandas Series or a windowed source such as
+# readdata.edf.EdfSource or segments.UniformView. Signals are only ever read
+# by blocks. Columns with missing samples are NaN.
+
+
+def readSamples(signal, start, stop):
+    if isinstance(signal, pd.Series):
+        return signal.values[start:stop]
+    if hasattr(signal, 'read'):
+        return signal.read(start, stop)
+    return np.asarray(signal[start:stop])
+
+
+def sampleTimes(signal, positions):
+    if isinstance(signal, pd.Series):
+        return signal.index.values[positions]
+    return signal.timestamps(positions)
+
+
+def frameCount(nsamples, winsize, step):
+    if nsamples < winsize:
+        return 0
+    return (nsamples - winsize) // step + 1
+
+
+def frames(values, winsize, step):
+    # Windows of winsize samples every step samples, as a strided view
+    values = np.ascontiguousarray(values)
+    nframes = frameCount(len(values), winsize, step)
+    stride = values.strides[0]
+    shape = (nframes, winsize)
+    strides = (step * stride, stride)
+    return np.lib.stride_tricks.as_strided(
+        values, shape=shape, strides=strides, writeable=False
+    )
+
+
+def periodogram(windows, taper):
+    spec = np.fft.rfft(windows * taper, axis=1) / len(taper)
+    return spec.real ** 2 + spec.imag ** 2
+
+
+def columnCount(nsamples, winsize, step, naverage=1):
+    return frameCount(nsamples, winsize, step) // naverage
+
+
+def psdColumns(signal, winsize, step, naverage, taper, begin, end):
+    # PSD columns [begin, end). Each column is the Welch average of naverage
+    # consecutive windows. Only the samples they cover are read.
+    hop = step * naverage
+    span = (naverage - 1) * step + winsize
+    values = readSamples(signal, begin * hop, (end - 1) * hop + span)
+    psd = periodogram(frames(values, winsize, step), taper)
+    if naverage > 1:
+        psd = psd.reshape(end - begin, naverage, -1).mean(axis=1)
+    return psd
+
+
+def iterPsd(signal, winsize, step, naverage=1, taper=None, batchsize=BATCHSIZE):
+    # Yield (first column, PSD columns) by batches
+    if taper is None:
+        taper = np.hanning(winsize)
+    ncolumns = columnCount(len(signal), winsize, step, naverage)
+    for begin in range(0, ncolumns, batchsize):
+        end = min(begin + batchsize, ncolumns)
+        psd = psdColumns(signal, winsize, step, naverage, taper, begin, end)
+        yield (begin, psd)
+
+
+def psdBuffer(ncolumns, winsize, filename=None):
+    # float32 PSD image, memory mapped to filename (a path or a file object)
+    # when given
+    shape = (ncolumns, winsize // 2 + 1)
+    if filename is None:
+        return np.empty(shape, dtype=np.float32)
+    return np.memmap(filename, dtype=np.float32, mode='w+', shape=shape)
+
+
+def spectrogram(signal, winsize, step, naverage=1, taper=None, out=None):
+    if out is None:
+        ncolumns = columnCount(len(signal), winsize, step, naverage)
+        out = psdBuffer(ncolumns, winsize)
+    for begin, batch in iterPsd(signal, winsize, step, naverage, taper):
+        out[begin : begin + len(batch)] = batch
+    return out
+
+
+def columnCentres(signal, winsize, step, naverage, ncolumns):
+    # Timestamp in the middle of the samples covered by each column
+    starts = np.arange(ncolumns) * step * naverage
+    stops = starts + (naverage - 1) * step + winsize - 1
+    starts = sampleTimes(signal, starts)
+    stops = sampleTimes(signal, stops)
+    return starts + (stops - starts) // 2
+
+
+def spectralEdge(psd, freqs, perc, batchsize=BATCHSIZE):
+    # Frequency below which perc percent of the power of each column lies,
+    # 0 where it is not defined and NaN for columns over gaps.
+    sef = np.zeros(len(psd))
+    for begin in range(0, len(psd), batchsize):
+        psdcs = np.cumsum(psd[begin : begin + batchsize], axis=1, dtype=np.float64)
+        thres = perc * psdcs[:, -1:] / 100
+        above = psdcs > thres
+        first = np.argmax(above, axis=1)
+        batchsef = np.where(above.any(axis=1), freqs[first], 0)
+        batchsef[np.isnan(thres[:, 0])] = np.nan
+        sef[begin : begin + len(psdcs)] = batchsef
+    return sef
+
+
+def levels(psd, lo=5, hi=95, maxcolumns=4096):
+    # Percentiles of the PSD on evenly spaced columns
+    stride = max(len(psd) // maxcolumns, 1)
+    sample = np.asarray(psd[::stride])
+    sample = sample[~np.isnan(sample)]
+    if len(sample) < 1:
+        return (0, 1)
+    return tuple(np.percentile(sample, [lo, hi]))
+
+
+def sampledLevels(signal, winsize, step, naverage=1, taper=None, nruns=16, runsize=16):
+    # levels on nruns runs of runsize PSD columns spread over the whole
+    # signal, without computing the others
+    if taper is None:
+        taper = np.hanning(winsize)
+    ncolumns = columnCount(len(signal), winsize, step, naverage)
+    if ncolumns < 1:
+        return (0, 1)
+    runsize = min(runsize, ncolumns)
+    begins = np.unique(np.linspace(0, ncolumns - runsize, nruns).astype(int))
+    psd = np.concatenate(
+        [
+            psdColumns(signal, winsize, step, naverage, taper, begin, begin + runsize)
+            for begin in begins
+        ]
+    )
+    return levels(psd)
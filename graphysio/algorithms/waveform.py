@@ -1,63 +1,63 @@
-import itertools
-
 import numpy as np
 import pandas as pd
 
+from graphysio.algorithms import segments
 from graphysio.utils import truncatevecs
 
 
 def findPressureFeet(curve):
+    # Each segment between gaps of the curve is searched independently
     series = curve.series
-    samplerate = curve.samplerate
+    parts = curve.segments.split(series)
+    if len(parts) < 2:
+        return pressureFeet(series, curve.samplerate)
+    feet = segments.getExecutor().map(
+        lambda part: pressureFeet(part, curve.samplerate), parts
+    )
+    return pd.Index(np.concatenate([foot.values for foot in feet]))
+
 
-    fstderiv = series.diff().shift(-1)
-    sndderiv = fstderiv.diff().shift(-1)
+def pressureFeet(series, samplerate):
+    values = series.to_numpy(dtype=np.float64)
+    fstderiv = np.append(np.diff(values), np.nan)
+    sndderiv = np.append(np.diff(fstderiv), np.nan)
 
     # Remove deceleration peaks
     sndderiv = sndderiv * (fstderiv > 0)
 
-    def performWindowing(sumcoef=4, quantcoef=3):
-        # Find pulse rising edge
-        winsum = int(samplerate / sumcoef)
+    # Find pulse rising edge. The integral does not depend on the
+    # quantile window, compute it only once for all attempts.
+    winsum = int(samplerate / 4)
+    sndderivsq = pd.Series(sndderiv ** 2)
+    integral = sndderivsq.rolling(window=winsum, center=True).sum()
+
+    def performWindowing(quantcoef):
         winquant = int(samplerate * quantcoef)
-        sndderivsq = sndderiv ** 2
-        integral = sndderivsq.rolling(window=winsum, center=True).sum()
+        # Skiplist based rolling quantile, O(n log(winquant))
         thres = integral.rolling(window=winquant).quantile(0.7)
-        thres = thres.fillna(method='backfill')
-        risings = (integral > thres).astype(int)
-        risingvar = risings.diff()
-        (risingStarts,) = (risingvar > 0).to_numpy().nonzero()
-        (risingStops,) = (risingvar < 0).to_numpy().nonzero()
-        return (risingStarts, risingStops)
+        thres = thres.bfill()
+        risings = (integral > thres).to_numpy()
+        (risingStarts,) = (risings[1:] & ~risings[:-1]).nonzero()
+        (risingStops,) = (~risings[1:] & risings[:-1]).nonzero()
+        return (risingStarts + 1, risingStops + 1)
 
     found = False
     for quantcoef in [3, 2, 1]:
         # Try again with smaller window if we find nothing
-        risingStarts, risingStops = performWindowing(quantcoef=quantcoef)
-        try:
+        risingStarts, risingStops = performWindowing(quantcoef)
+        if len(risingStarts) > 0:
             risingStops = risingStops[risingStops > risingStarts[0]]
             found = True
             break
-        except IndexError:
-            continue
 
-    # Last resort: find one foot on the whole series
+    # Last resort: find one foot on the whole segment
     if not found:
-        risingStarts = [0]
-        risingStops = [len(sndderiv) - 1]
-
-    def locateMaxima():
-        for start, stop in zip(risingStarts, risingStops):
-            idxstart = sndderiv.index[start]
-            idxstop = sndderiv.index[stop]
-            try:
-                maximum = sndderiv.loc[idxstart:idxstop].idxmax()
-            except ValueError:
-                continue
-            else:
-                yield maximum
-
-    cycleStarts = pd.Index(list(locateMaxima()))
+        risingStarts = np.array([0])
+        risingStops = np.array([len(sndderiv) - 1])
+
+    nstarts = min(len(risingStarts), len(risingStops))
+    maxima = segmentArgmax(sndderiv, risingStarts[:nstarts], risingStops[:nstarts])
+    cycleStarts = pd.Index(series.index.values[maxima])
     return cycleStarts
 
 
@@ -80,17 +80,12 @@ def findFlowCycles(curve):
 
 def findPressureCycles(curve):
     series = curve.series
-
-    cycles = []
     starts, durations = curve.getCycleIndices()
-    for start, duration in zip(starts, durations):
-        stop = start + duration
-        diastop = start - duration
-        dia = findPOI(series, [start, diastop], 'min', windowsize=0.05, forcesign=False)
-        sbp = findPOI(series, [start, stop], 'max', windowsize=0.05)
-        cycle = (dia, sbp)
-        cycles.append(cycle)
-    return [pd.Index(idx, dtype=np.int64) for idx in zip(*cycles)]
+    dia = findPOIs(series, starts, starts - durations, 'min', 0.05, forcesign=False)
+    sbp = findPOIs(series, starts, starts + durations, 'max', 0.05)
+    found = (dia >= 0) & (sbp >= 0)
+    labels = series.index.values
+    return [pd.Index(labels[pos[found]], dtype=np.int64) for pos in (dia, sbp)]
 
 
 def findPressureFull(curve):
@@ -104,68 +99,102 @@ def findPressureFull(curve):
 # Utility function for point placing
 
 
-def isbetter(new, ref, kind, forcesign):
-    if kind == 'max':
-        condition = new > ref
-        if forcesign:
-            condition = condition or (new < 0)
-    elif kind == 'min':
-        condition = new < ref
-        if forcesign:
-            condition = condition or (new > 0)
-    else:
+def raggedPositions(starts, lengths):
+    # Positions of the segments [start, start + length) laid out end to end,
+    # along with the offset of each segment in the flat layout.
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.arange(np.sum(lengths)) + np.repeat(starts - offsets, lengths)
+    return (positions, offsets)
+
+
+def segmentArgmax(values, starts, stops):
+    # Position of the first maximum of values in each [start, stop] segment.
+    # NaNs are skipped, empty and all-NaN segments are dropped.
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(stops, dtype=np.int64) - starts + 1
+    notempty = lengths > 0
+    starts, lengths = starts[notempty], lengths[notempty]
+    if len(starts) < 1:
+        return np.array([], dtype=np.int64)
+    positions, offsets = raggedPositions(starts, lengths)
+    segvalues = values[positions]
+    segvalues = np.where(np.isnan(segvalues), -np.inf, segvalues)
+    segmax = np.maximum.reduceat(segvalues, offsets)
+    ismax = segvalues == np.repeat(segmax, lengths)
+    firstmax = np.where(ismax, positions, len(values))
+    argmax = np.minimum.reduceat(firstmax, offsets)
+    return argmax[segmax > -np.inf]
+
+
+def findPOIs(soi, begins, ends, kind, windowsize, forcesign=True):
+    # Hill-climb from each begin towards the corresponding end in windows of
+    # windowsize seconds while the extremum of the window keeps improving.
+    # Returns the position of the extremum of the last improving window for
+    # each interval, or -1 if there is no data at the beginning.
+    if kind not in ['min', 'max']:
         raise ValueError(kind)
-    return condition
+    # Epoch ns only have ns precision in int64, float64 rounds them to 256 ns
+    begins = np.asarray(begins)
+    ends = np.asarray(ends)
+    missing = pd.isna(begins) | pd.isna(ends)
+    begins = np.where(missing, 0, begins).astype(np.int64)
+    ends = np.where(missing, 0, ends).astype(np.int64)
+    labels = soi.index.values
+    values = soi.to_numpy(dtype=np.float64)
+    if kind == 'min':
+        # Finding the minimum is finding the maximum of the opposite
+        values = -values
+    windowspan = int(round(windowsize * 1e9))  # s to ns
+
+    # Lay out all windows of all intervals end to end
+    direction = np.where(ends > begins, 1, -1)
+    nwindows = np.abs(ends - begins) // windowspan + 2
+    nwindows[missing] = 0
+    nintervals = len(nwindows)
+    if nintervals < 1 or np.sum(nwindows) < 1:
+        return np.full(nintervals, -1, dtype=np.int64)
+    woffsets = np.cumsum(nwindows) - nwindows
+    interval = np.repeat(np.arange(nintervals), nwindows)
+    n = np.arange(np.sum(nwindows)) - np.repeat(woffsets, nwindows)
+
+    # Window boundaries, inclusive on both ends
+    ltr = np.repeat(direction > 0, nwindows)
+    wbegin = begins[interval] + direction[interval] * n * windowspan
+    wend = wbegin + direction[interval] * windowspan
+    wend = np.where(ltr, np.minimum(wend, ends[interval]), wend)
+    wend = np.where(~ltr, np.maximum(wend, ends[interval]), wend)
+    lo = np.searchsorted(labels, np.where(ltr, wbegin, wend), side='left')
+    hi = np.searchsorted(labels, np.where(ltr, wend, wbegin), side='right')
+
+    # Maximum of each window. Pad values so hi is always a valid index.
+    padded = np.append(values, np.nan)
+    bounds = np.column_stack([lo, hi]).ravel()
+    wmax = np.maximum.reduceat(padded, bounds)[::2]
+
+    # Keep climbing while windows are not empty and the maximum improves
+    isfirst = n == 0
+    previous = np.where(isfirst, -np.inf, np.roll(wmax, 1))
+    better = wmax > previous
+    if forcesign:
+        better |= wmax < 0
+    climbing = (hi > lo) & better
+    firstbad = np.where(climbing, nwindows[interval], n)
+    lastgood = np.minimum.reduceat(firstbad, woffsets[nwindows > 0]) - 1
+    goodinterval = np.flatnonzero(nwindows > 0)[lastgood >= 0]
+    goodwindow = woffsets[goodinterval] + lastgood[lastgood >= 0]
+
+    pois = np.full(nintervals, -1, dtype=np.int64)
+    argmax = segmentArgmax(values, lo[goodwindow], hi[goodwindow] - 1)
+    pois[goodinterval] = argmax
+    return pois
 
 
-def genWindows(soi, interval, windowspan):
+def findPOI(soi, interval, kind, windowsize, forcesign=True):
     begin, end = interval
-    ltr = end > begin
-    windowspan *= 1e9  # s to ns
     if begin is None or end is None:
-        return
-    direction = 1 if ltr else -1
-    for n in itertools.count():
-        start = begin + direction * n * windowspan
-        stop = start + direction * windowspan
-
-        # Stop condition if we exceed end
-        if ltr:
-            if stop >= end:
-                stop = end
-        else:
-            if stop <= end:
-                stop = end
-            start, stop = (stop, start)
-
-        window = soi.loc[start:stop]
-        if len(window) < 1:
-            return
-        yield window.index.values
-
-
-def findPOI(soi, interval, kind, windowsize, forcesign=True):
-    if kind not in ['min', 'max']:
-        raise ValueError(kind)
-    argkind = 'idx' + kind
-
-    goodwindow = []
-    previous = -np.inf if kind == 'max' else np.inf
-    for window in genWindows(soi, interval, windowsize):
-        zoi = soi.loc[window]
-        new = getattr(zoi, kind)()
-        if isbetter(new, previous, kind, forcesign):
-            goodwindow = window
-        else:
-            break
-        previous = new
-    finalzoi = soi.loc[goodwindow]
-    try:
-        retidx = getattr(finalzoi, argkind)()
-    except ValueError:
-        # No POI found
-        retidx = None
-    return retidx
+        return None
+    (pos,) = findPOIs(soi, [begin], [end], kind, windowsize, forcesign)
+    return soi.index[pos] if pos >= 0 else None
 
 
 def findPOIGreedy(soi, start, kind):
@@ -199,23 +228,43 @@ def findPOIGreedy(soi, start, kind):
     return soi.index[curloc]
 
 
-def distance(l1, l2, p):
-    return np.cross(l2 - l1, p - l1) / np.linalg.norm(l2 - l1)
-
-
 def findDicProj(series, dia, sbp, upstroke_duration):
-    dics = []
-    for si, di, up in zip(sbp, dia, upstroke_duration):
-        zoi = series.loc[si:di]
-        if len(zoi) < 1:
-            continue
-        p1 = np.array([si, zoi.iloc[0]])
-        p2 = np.array([di, zoi.iloc[-1]])
-        p3 = np.vstack([zoi.index, zoi.values]).transpose()
-        d = distance(p1, p2, p3)
-        # Limit search zone to the beginning of the segment
-        search_len = len(series.loc[si : si + 2 * up])
-        search_zone = d[0:search_len]
-        argmin = np.argmin(search_zone)
-        dics.append(zoi.index[argmin])
-    return pd.Index(dics)
+    # For each beat, the dicrotic notch is the sample furthest below the line
+    # joining the systole to the next diastole, searched in the two upstroke
+    # durations following the systole. All beats are handled at once on a
+    # ragged layout of their search zones.
+    nbeats = min(len(dia), len(sbp), len(upstroke_duration))
+    sbp = np.asarray(sbp[:nbeats], dtype=np.int64)
+    dia = np.asarray(dia[:nbeats], dtype=np.int64)
+    up = np.asarray(upstroke_duration[:nbeats], dtype=np.int64)
+
+    labels = series.index.values
+    values = series.to_numpy(dtype=np.float64)
+    zoistarts = np.searchsorted(labels, sbp, side='left')
+    zoistops = np.searchsorted(labels, dia, side='right')
+    searchstops = np.searchsorted(labels, sbp + 2 * up, side='right')
+    lengths = np.minimum(zoistops, searchstops) - zoistarts
+    valid = (zoistops > zoistarts) & (lengths > 0)
+    zoistarts, zoistops, lengths = zoistarts[valid], zoistops[valid], lengths[valid]
+    sbp, dia = sbp[valid], dia[valid]
+    if len(zoistarts) < 1:
+        return pd.Index([], dtype=np.int64)
+
+    # Line from (systole, first value) to (diastole, last value)
+    x1 = sbp.astype(np.float64)
+    y1 = values[zoistarts]
+    dx = dia.astype(np.float64) - x1
+    dy = values[zoistops - 1] - y1
+    norm = np.sqrt(dx * dx + dy * dy)
+
+    positions, offsets = raggedPositions(zoistarts, lengths)
+    px = labels[positions].astype(np.float64) - np.repeat(x1, lengths)
+    py = values[positions] - np.repeat(y1, lengths)
+    cross = np.repeat(dx, lengths) * py - np.repeat(dy, lengths) * px
+    d = cross / np.repeat(norm, lengths)
+    # Systole and diastole may coincide, give precedence to the first NaN as
+    # np.argmin does
+    d[np.isnan(d)] = -np.inf
+
+    argmin = segmentArgmax(-d, offsets, offsets + lengths - 1)
+    return pd.Index(labels[positions[argmin]])
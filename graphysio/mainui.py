@@ -10,6 +10,7 @@ from PyQt5 import QtCore, QtWidgets
 
 from graphysio import dialogs, readdata, ui, utils
 from graphysio.plotwidgets import TSWidget
+from graphysio.readdata import cache
 
 
 class MainUi(ui.Ui_MainWindow, QtWidgets.QMainWindow):
@@ -37,6 +38,7 @@ class MainUi(ui.Ui_MainWindow, QtWidgets.QMainWindow):
         self.menuFile.addSeparator()
         self.menuFile.addAction('&Load plugin', self.errguard(utils.loadmodule))
         self.menuFile.addAction('Get CLI shell', self.errguard(getCLIShell))
+        self.menuFile.addAction('Clear CSV cache', self.errguard(cache.purge))
         self.menuFile.addSeparator()
         self.menuFile.addAction('&Quit', self.close, QtCore.Qt.CTRL + QtCore.Qt.Key_Q)
 
@@ -147,12 +149,20 @@ class MainUi(ui.Ui_MainWindow, QtWidgets.QMainWindow):
             title='Append to plot',
         )
 
-        for fieldname in plotdata.data:
+        for fieldname in list(plotdata.data):
             newname = plotwidget.validateNewCurveName(fieldname)
             if newname is None:
                 continue
-            if newname != fieldname:
+            if newname == fieldname:
+                continue
+            if isinstance(plotdata.data, dict):
+                series = plotdata.data.pop(fieldname)
+                plotdata.data[newname] = series.rename(newname)
+            else:
                 plotdata.data.rename(columns={fieldname: newname}, inplace=True)
+            if fieldname in plotdata.samplerates:
+                samplerate = plotdata.samplerates.pop(fieldname)
+                plotdata.samplerates[newname] = samplerate
 
         plotwidget.appendData(plotdata, dorealign)
         plotwidget.properties['dircache'] = self.dircache
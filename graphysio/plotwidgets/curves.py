@@ -6,7 +6,10 @@ import pyqtgraph as pg
 from pyqtgraph.Qt import QtCore, QtGui
 
 from graphysio import utils
-from graphysio.algorithms import waveform
+from graphysio.algorithms import segments, waveform
+from graphysio.algorithms.segments import Segments
+from graphysio.plotwidgets.lod import MinMaxPyramid
+from graphysio.plotwidgets.poistore import POIStore
 from graphysio.structures import CycleId
 from graphysio.utils import estimateSampleRate
 
@@ -15,15 +18,9 @@ class CurveItem(pg.PlotDataItem):
     visible = QtCore.pyqtSignal()
     invisible = QtCore.pyqtSignal()
 
-    def __init__(self, series, parent, pen=None):
+    def __init__(self, series, parent, pen=None, samplerate=None):
         self.parent = parent
-        # Drop NA. All following code can assume no NaNs.
-        series = series.dropna()
-        # Make timestamp unique and use mean of values on duplicates
-        series = series.groupby(level=0).mean()
-
-        self.series = series
-        self.samplerate = estimateSampleRate(self.series)
+        self.load(series, samplerate)
 
         if pen is None:
             pen = QtGui.QColor(QtCore.Qt.black)
@@ -31,14 +28,102 @@ class CurveItem(pg.PlotDataItem):
         super().__init__(name=series.name, pen=pen, antialias=True)
         self.render()
 
+    def load(self, series, samplerate=None):
+        # Drop NA. All following code can assume no NaNs.
+        if series.hasnans:
+            series = series.dropna()
+        intervals = np.diff(series.index)
+        if not np.all(intervals > 0):
+            # Make timestamp unique and use mean of values on duplicates
+            series = series.groupby(level=0).mean()
+            intervals = np.diff(series.index)
+        elif series.dtype.kind != 'f':
+            # Same dtype as the mean would give
+            series = series.astype(np.float64)
+
+        self.series = series
+        if samplerate is None:
+            samplerate = estimateSampleRate(series, intervals)
+        self.samplerate = samplerate
+
+    @property
+    def series(self):
+        return self.__series
+
+    @series.setter
+    def series(self, series):
+        self.__series = series
+        self.__segments = None
+        self.lod = MinMaxPyramid(series.values)
+
+    @property
+    def segments(self):
+        # Contiguous runs of samples between the gaps of the series. Getting
+        # the series first loads lazy curves, which resets the segments.
+        series = self.series
+        if self.__segments is None:
+            self.__segments = Segments.fromIndex(series.index.values)
+        return self.__segments
+
+    def begin(self):
+        # Timestamp of the first sample
+        return self.series.index[0]
+
+    def shift(self, offset):
+        self.series.index += offset
+
+    def viewRangeChanged(self, *args, **kwargs):
+        super().viewRangeChanged(*args, **kwargs)
+        self.render()
+
+    def dataBounds(self, ax, frac=1.0, orthoRange=None):
+        # Auto range on the whole series, not only on the rendered part
+        if frac < 1.0 or orthoRange is not None or len(self.series) < 1:
+            return super().dataBounds(ax, frac, orthoRange)
+        if ax == 0:
+            return (self.series.index[0], self.series.index[-1])
+        return self.lod.bounds(self.series.values)
+
     def render(self):
-        self.setData(x=self.series.index.values, y=self.series.values)
+        x = self.series.index.values
+        y = self.series.values
+        vb = self.getViewBox()
+        if vb is None:
+            # Not displayed, render the whole curve at default resolution
+            imin, imax = 0, len(x)
+            npoints = 2000
+        else:
+            xmin, xmax = vb.viewRange()[0]
+            # Include one sample beyond the view on each side to reach the edges
+            imin = max(np.searchsorted(x, xmin) - 1, 0)
+            imax = min(np.searchsorted(x, xmax, side='right') + 1, len(x))
+            npoints = max(int(vb.width()), 1)
+        envx, envy = self.lod.envelope(x, y, imin, imax, npoints)
+        self.setData(x=envx, y=envy)
 
     def extend(self, newseries):
-        merged1 = self.series.append(newseries)
-        merged2 = merged1.sort_index()
-        newseries = merged2.groupby(merged2.index).mean()
-        self.series = newseries
+        series = self.series
+        if not newseries.index.is_monotonic_increasing:
+            newseries = newseries.sort_index()
+        # Only the samples of series within the time range of newseries can
+        # collide with it. Samples before are unchanged, samples after are
+        # shifted.
+        begin = np.searchsorted(series.index, newseries.index[0])
+        end = np.searchsorted(series.index, newseries.index[-1], side='right')
+        overlap = series.iloc[begin:end]
+        if len(overlap) > 0 or not newseries.index.is_unique:
+            merged = pd.concat([overlap, newseries]).sort_index()
+            newseries = merged.groupby(merged.index).mean()
+        index = np.concatenate(
+            [series.index[:begin], newseries.index, series.index[end:]]
+        )
+        values = np.concatenate(
+            [series.values[:begin], newseries.values, series.values[end:]]
+        )
+        index = pd.Index(index, name=series.index.name)
+        self.__series = pd.Series(values, index=index, name=series.name)
+        self.__segments = None
+        self.lod.update(values, start=begin)
         self.render()
 
     def rename(self, newname: str):
@@ -46,6 +131,10 @@ class CurveItem(pg.PlotDataItem):
         self.opts['name'] = newname
 
 
+# Markers are grouped by this many pixel columns when too dense
+AGGREGATEPX = 4
+
+
 class POIItem(pg.ScatterPlotItem):
     sym = {
         'start': 'star',
@@ -60,78 +149,121 @@ class POIItem(pg.ScatterPlotItem):
     def __init__(self, parent, name, pen=None):
         super().__init__(pen=pen, name=name)
         self.parent = parent
-        self.indices = {}
-        self.selected = []
+        self.indices = POIStore(parent)
+        # Selected points as (key, location)
+        self.selected = set()
+        self.aggregated = False
+        self.maxpoints = 0
         self.resym = {value: key for key, value in self.sym.items()}
         self.render()
 
     def addPointsByLocation(self, key, locations):
-        if key not in self.indices:
-            self.indices[key] = pd.Index([])
-        oldidx = self.indices[key]
-        newidx = oldidx.append(pd.Index(locations))
-        self.indices[key] = newidx.unique().sort_values()
-        self.render()
+        x, y = self.indices.add(key, locations)
+        vb = self.getViewBox()
+        if vb is None:
+            return
+        xmin, xmax = vb.viewRange()[0]
+        drawable = ~np.isnan(y) & (x >= xmin) & (x <= xmax)
+        ndrawable = np.count_nonzero(drawable)
+        if ndrawable < 1:
+            return
+        if self.aggregated or len(self.data) + ndrawable > self.maxpoints:
+            self.render()
+        else:
+            # Only draw the new points
+            self.addPoints(x=x[drawable], y=y[drawable], symbol=self.sym[key])
 
     def removePointsByLocation(self, key, locations):
         if key not in self.indices:
             return
-        oldidx = self.indices[key]
-        dellocs = []
-        for loc in locations:
-            locidx = oldidx.get_loc(loc, method='nearest')
-            dellocs.append(locidx)
-        newidx = oldidx.delete(dellocs)
-        self.indices[key] = newidx
+        self.indices.remove(key, locations)
         self.render()
 
     def removePoints(self, points):
+        locations = {}
         for point in points:
             try:
-                sym = self.resym[point.symbol()]
-                idx = self.indices[sym]
+                key, location = self.pointKey(point)
             except KeyError:
                 # Should not happen
                 continue
-            nidx = idx.get_loc(point.pos().x(), method='nearest')
-            self.indices[sym] = idx.delete(nidx)
+            locations.setdefault(key, []).append(location)
+        for key, locs in locations.items():
+            self.indices.remove(key, locs)
+        self.render()
+
+    def viewRangeChanged(self, *args):
         self.render()
 
     def render(self):
-        data = []
-        for key, idx in self.indices.items():
-            if len(idx) < 1:
-                continue
-            idxnona = idx.dropna()
-            points = self.parent.series.loc[idxnona]
-            tmp = pd.DataFrame({'points': points, 'sym': self.sym[key]}, index=idxnona)
-            data.append(tmp)
-        if len(data) < 1:
+        # Only draw the points within the view. Above one point per pixel
+        # column, keep one point by group of AGGREGATEPX columns per key.
+        vb = self.getViewBox()
+        if vb is None:
             self.clear()
             return
-        feet = pd.concat(data)
-        self.setData(
-            x=feet.index.values, y=feet['points'].values, symbol=feet['sym'].values
-        )
+        xmin, xmax = vb.viewRange()[0]
+        npixels = max(int(vb.width()), 1)
+        self.maxpoints = npixels
+
+        visible = {}
+        for key in self.indices:
+            locations = self.indices.locations[key]
+            begin = np.searchsorted(locations, xmin)
+            end = np.searchsorted(locations, xmax, side='right')
+            x = locations[begin:end]
+            y = self.indices.yvalues(key)[begin:end]
+            drawable = ~np.isnan(y)
+            visible[key] = (x[drawable], y[drawable])
+
+        self.aggregated = sum(len(x) for x, _ in visible.values()) > self.maxpoints
+        xs, ys, syms = [], [], []
+        for key, (x, y) in visible.items():
+            if self.aggregated:
+                pxwidth = (xmax - xmin) / npixels
+                groups = ((x - xmin) / (pxwidth * AGGREGATEPX)).astype(np.int64)
+                _, first = np.unique(groups, return_index=True)
+                x, y = x[first], y[first]
+            xs.append(x)
+            ys.append(y)
+            syms.append(np.full(len(x), self.sym[key], dtype=object))
+        if sum(map(len, xs)) < 1:
+            self.clear()
+            return
+        x, y, symbols = map(np.concatenate, [xs, ys, syms])
+        self.setData(x=x, y=y, symbol=symbols)
+        if self.selected:
+            for point in self.points():
+                if self.isPointSelected(point):
+                    point.setPen('r')
+                    point.setBrush('r')
+
+    def pointKey(self, point):
+        # Point type and exact location of a drawn point
+        key = self.resym[point.symbol()]
+        (pos,) = self.indices.nearest(key, [point.pos().x()])
+        return (key, self.indices.locations[key][pos])
 
     def isPointSelected(self, point):
-        return point in self.selected
+        return self.pointKey(point) in self.selected
 
     def selectPoint(self, point):
-        if not self.isPointSelected(point):
-            self.selected.append(point)
+        self.selected.add(self.pointKey(point))
         point.setPen('r')
         point.setBrush('r')
 
     def unselectPoint(self, point):
-        if self.isPointSelected(point):
-            self.selected.remove(point)
+        self.selected.discard(self.pointKey(point))
         point.resetPen()
         point.resetBrush()
 
     def removeSelection(self):
-        self.removePoints(self.selected)
-        self.selected = []
+        locations = {}
+        for key, location in self.selected:
+            locations.setdefault(key, []).append(location)
+        for key, locs in locations.items():
+            self.indices.remove(key, locs)
+        self.selected = set()
         self.render()
 
     def rename(self, newname: str):
@@ -150,8 +282,8 @@ class CurveItemWithPOI(CurveItem):
         else:
             feetitem.unselectPoint(point)
 
-    def __init__(self, series, parent, pen=None):
-        super().__init__(series, parent, pen)
+    def __init__(self, series, parent, pen=None, samplerate=None):
+        super().__init__(series, parent, pen, samplerate)
         feetname = f'{series.name}-feet'
         self.feetitem = POIItem(self, name=feetname, pen=pen)
         parent.addItem(self.feetitem)
@@ -232,3 +364,137 @@ class CurveItemWithPOI(CurveItem):
         feetidx = self.feetitem.indices[feetname]
         feetnona = feetidx[pd.notnull(feetidx)]
         return self.series.loc[feetnona]
+
+
+# Blocks decoded per background job when summarizing lazy curves. The curve
+# is rendered again after each job.
+SUMMARYBATCH = 8
+
+
+class LazyCurveItem(CurveItemWithPOI):
+    # Curve backed by a windowed source such as readdata.edf.EdfSource. Only
+    # the visible range is decoded until the whole series is needed. Zoomed
+    # out views are drawn from the block summaries available, the missing
+    # ones are decoded in the background.
+    summarized = QtCore.pyqtSignal()
+    summarizing = None
+
+    def __init__(self, source, parent, pen=None, samplerate=None):
+        super().__init__(source, parent, pen, samplerate)
+        self.summarized.connect(self.render)
+
+    def load(self, source, samplerate=None):
+        if isinstance(source, pd.Series):
+            # Replaced by data in memory, e.g. filtered in place
+            self.source = None
+            super().load(source, samplerate)
+            return
+        self.source = source
+        self.samplerate = source.samplerate
+
+    @property
+    def series(self):
+        if self.source is not None:
+            series = self.source.series().dropna()
+            self.source = None
+            CurveItem.series.fset(self, series)
+        return CurveItem.series.fget(self)
+
+    @series.setter
+    def series(self, series):
+        self.source = None
+        CurveItem.series.fset(self, series)
+
+    def begin(self):
+        # Without decoding the source
+        if self.source is not None:
+            return self.source.timestamps([0])[0]
+        return super().begin()
+
+    def shift(self, offset):
+        if self.source is not None:
+            self.source.shift(offset)
+        else:
+            super().shift(offset)
+
+    def dataBounds(self, ax, frac=1.0, orthoRange=None):
+        source = self.source
+        if source is None:
+            return super().dataBounds(ax, frac, orthoRange)
+        if ax == 0:
+            # Whole time range, known from the source without decoding
+            if len(source) < 1:
+                return (None, None)
+            return tuple(source.timestamps([0, len(source) - 1]))
+        return pg.PlotDataItem.dataBounds(self, ax, frac, orthoRange)
+
+    def render(self):
+        source = self.source
+        if source is None:
+            super().render()
+            return
+        vb = self.getViewBox()
+        if vb is None:
+            # Not displayed, only render the beginning
+            imin, imax = 0, min(source.blocksize, len(source))
+            npoints = 2000
+        else:
+            xmin, xmax = vb.viewRange()[0]
+            imin = max(source.position(xmin) - 1, 0)
+            imax = min(source.position(xmax, side='right') + 1, len(source))
+            npoints = max(int(vb.width()), 1)
+
+        nsamples = imax - imin
+        if nsamples <= 4 * source.blocksize:
+            x = source.timestamps(np.arange(imin, imax))
+            y = source.read(imin, imax)
+            lod = MinMaxPyramid(y)
+            envx, envy = lod.envelope(x, y, 0, nsamples, npoints)
+        else:
+            # Combine the chunk summaries down to about npoints blocks
+            missing = source.missingSummaries(imin, imax)
+            if missing:
+                self.summarize(missing)
+            starts, mins, maxs = source.summary(imin, imax)
+            if len(starts) < 1:
+                self.setData(x=[], y=[])
+                return
+            stops = np.minimum(starts + source.summarysize, len(source)) - 1
+            factor = -(-len(starts) // (2 * npoints))
+            bounds = np.arange(0, len(starts), factor)
+            mins = np.minimum.reduceat(mins, bounds)
+            maxs = np.maximum.reduceat(maxs, bounds)
+            bstops = np.append(bounds[1:], len(starts)) - 1
+            bx = [source.timestamps(starts[bounds]), source.timestamps(stops[bstops])]
+            envx = np.column_stack(bx).ravel()
+            envy = np.column_stack([mins, maxs]).ravel()
+        self.setData(x=envx, y=envy)
+
+    def summarize(self, blocks):
+        # Decode the first of blocks in the background, one job at a time
+        if self.summarizing is not None and not self.summarizing.done():
+            return
+        source = self.source
+        batch = blocks[:SUMMARYBATCH]
+
+        def job():
+            with source.opened():
+                for b in batch:
+                    source.decode(b)
+
+        def done(future):
+            # Failed jobs are retried on the next render
+            if future.exception() is None:
+                self.summarized.emit()
+
+        mainwindow = getattr(self.parent, 'parent', None)
+        executor = getattr(mainwindow, 'executor', None) or segments.getExecutor()
+        self.summarizing = executor.submit(job)
+        self.summarizing.add_done_callback(done)
+
+    def rename(self, newname: str):
+        if self.source is None:
+            super().rename(newname)
+            return
+        self.source.rename(newname)
+        self.opts['name'] = newname
@@ -0,0 +1,83 @@
+import numpy as np
+
+
+class MinMaxPyramid:
+    # Level n holds the min and max of consecutive blocks of factor ** (n + 1)
+    # samples. Levels stop once they hold fewer than minblocks blocks.
+    def __init__(self, values, factor=8, minblocks=1024):
+        self.factor = factor
+        self.minblocks = minblocks
+        self.levels = []
+        self.nsamples = 0
+        self.update(values)
+
+    def blocksize(self, level):
+        return self.factor ** (level + 1)
+
+    def update(self, values, start=0):
+        # Recompute all blocks containing samples from position start onwards.
+        # Blocks before start are kept as is, making appends cheap.
+        values = np.asarray(values)
+        self.nsamples = len(values)
+        mins = maxs = values
+        level = 0
+        while len(mins) > self.minblocks:
+            if level >= len(self.levels):
+                # New level, reduce the whole previous one
+                start = 0
+            first = start // self.blocksize(level)
+            blockstarts = np.arange(first * self.factor, len(mins), self.factor)
+            if len(blockstarts) > 0:
+                newmins = np.minimum.reduceat(mins, blockstarts)
+                newmaxs = np.maximum.reduceat(maxs, blockstarts)
+            else:
+                newmins = newmaxs = values[0:0]
+            if level < len(self.levels):
+                oldmins, oldmaxs = self.levels[level]
+                newmins = np.concatenate([oldmins[:first], newmins])
+                newmaxs = np.concatenate([oldmaxs[:first], newmaxs])
+                self.levels[level] = (newmins, newmaxs)
+            else:
+                self.levels.append((newmins, newmaxs))
+            mins, maxs = newmins, newmaxs
+            level += 1
+        del self.levels[level:]
+
+    def bounds(self, values):
+        # Min and max of values, from the coarsest level if there is one
+        if self.levels:
+            mins, maxs = self.levels[-1]
+        else:
+            mins = maxs = np.asarray(values)
+        return (mins.min(), maxs.max())
+
+    def envelope(self, x, y, imin, imax, npoints):
+        # Min and max of npoints to 2 * npoints groups of samples covering
+        # [imin, imax), reduced from the coarsest level with at least npoints
+        # blocks there
+        nsamples = imax - imin
+        if nsamples <= 2 * npoints:
+            return (x[imin:imax], y[imin:imax])
+        bs = 1
+        mins = maxs = np.asarray(y)
+        for n in range(len(self.levels)):
+            if nsamples / self.blocksize(n) < npoints:
+                break
+            bs = self.blocksize(n)
+            mins, maxs = self.levels[n]
+
+        bfirst = imin // bs
+        blast = -(-imax // bs)
+        # Groups are aligned on multiples of their size so that they stay the
+        # same while panning
+        group = max((blast - bfirst) // npoints, 1)
+        gstarts = np.arange(bfirst // group * group, blast, group)
+        gstarts[0] = bfirst
+        gstops = np.append(gstarts[1:], blast)
+        envmins = np.minimum.reduceat(mins[bfirst:blast], gstarts - bfirst)
+        envmaxs = np.maximum.reduceat(maxs[bfirst:blast], gstarts - bfirst)
+        sstarts = gstarts * bs
+        sstops = np.minimum(gstops * bs, self.nsamples) - 1
+        envx = np.column_stack([x[sstarts], x[sstops]]).ravel()
+        envy = np.column_stack([envmins, envmaxs]).ravel()
+        return (envx, envy)
@@ -1,8 +1,10 @@
 from typing import Optional
 
+import pandas as pd
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtCore, QtGui
 
+from graphysio.algorithms import pipeline
 from graphysio.legend import LegendItem
 from graphysio.plotwidgets import curves
 from graphysio.utils import Colors
@@ -26,6 +28,8 @@ class PlotWidget(pg.PlotWidget):
         self.name = name
         self.colors = Colors()
         self.hiddencurves = set()
+        # Displayed curves by name, in the order they were added
+        self._curves = {}
         self.properties = properties
 
         axisItems = {'bottom': TimeAxisItem(orientation='bottom')}
@@ -40,26 +44,36 @@ class PlotWidget(pg.PlotWidget):
         self.setCursor(QtCore.Qt.CrossCursor)
 
     def appendData(self, newplotdata, dorealign=False):
+        # Update the auto range once after adding all curves
+        xauto, yauto = self.vb.autoRangeEnabled()
+        self.vb.disableAutoRange()
         for seriesname in newplotdata.data:
-            self.addSeriesAsCurve(newplotdata.data[seriesname], dorealign=dorealign)
+            self.addSeriesAsCurve(
+                newplotdata.data[seriesname],
+                dorealign=dorealign,
+                samplerate=newplotdata.samplerates.get(seriesname),
+            )
+        self.vb.enableAutoRange(x=xauto, y=yauto)
+        self.vb.updateAutoRange()
 
     @property
     def curves(self):
-        return {
-            item.name(): item
-            for item in self.listDataItems()
-            if isinstance(item, curves.CurveItem)
-        }
+        return self._curves
 
     def getPen(self):
         return next(self.colors)
 
-    def addSeriesAsCurve(self, series, pen=None, dorealign=False, withfeet=True):
+    def addSeriesAsCurve(
+        self, series, pen=None, dorealign=False, withfeet=True, samplerate=None
+    ):
         if len(series) < 1:
             return
+        if not isinstance(series, pd.Series):
+            # Windowed source, decoded on demand
+            return self.addSourceAsCurve(series, pen, dorealign)
         if dorealign and self.curves:
             # Timeshift new curves to make the beginnings coincide
-            begins = [curve.series.index[0] for curve in self.curves.values()]
+            begins = [curve.begin() for curve in self.curves.values()]
             offset = min(begins) - series.index[0]
             series.index += offset
         try:
@@ -71,26 +85,52 @@ class PlotWidget(pg.PlotWidget):
             if pen is None:
                 pen = self.getPen()
             Curve = curves.CurveItemWithPOI if withfeet else curves.CurveItem
-            curve = Curve(series=series, parent=self, pen=pen)
+            curve = Curve(series=series, parent=self, pen=pen, samplerate=samplerate)
             self.addCurve(curve)
         return curve
 
+    def addSourceAsCurve(self, source, pen=None, dorealign=False):
+        if source.name in self.curves:
+            # Merge into the existing curve
+            return self.addSeriesAsCurve(source.series(), pen, dorealign)
+        if dorealign and self.curves:
+            begins = [curve.begin() for curve in self.curves.values()]
+            source.shift(min(begins) - source.timestamps([0])[0])
+        if pen is None:
+            pen = self.getPen()
+        curve = curves.LazyCurveItem(source, parent=self, pen=pen)
+        self.addCurve(curve)
+        return curve
+
     def addCurve(self, curve, pen=None):
         if curve.name() in self.curves:
             return
         if pen is not None:
             curve.setPen(pen)
         self.addItem(curve)
-        self.rebuildLegend()
+        self._curves[curve.name()] = curve
+        self.legend.addItem(curve, curve.name())
         curve.visible.emit()
 
     def removeCurve(self, curve):
-        if curve.name() not in self.curves:
+        if self._curves.get(curve.name()) is not curve:
             return
         self.removeItem(curve)
+        del self._curves[curve.name()]
+        pipeline.detach(curve)
         self.rebuildLegend()
         curve.invisible.emit()
 
+    def renameCurve(self, curve, newname: str) -> None:
+        oldname = curve.name()
+        curve.rename(newname)
+        if self._curves.get(oldname) is not curve:
+            # Hidden curve
+            return
+        self._curves = {
+            (newname if c is curve else name): c for name, c in self._curves.items()
+        }
+
     def rebuildLegend(self):
         self.legend.clear()
         for name, curve in self.curves.items():
@@ -117,7 +157,7 @@ class PlotWidget(pg.PlotWidget):
         # curve.setData(symbol=properties['symbol'])
         # curve.setData(connect=properties['connect'], symbol=properties['symbol'])
         curve.setPen(properties['color'], width=properties['width'])
-        curve.rename(properties['name'])
+        self.renameCurve(curve, properties['name'])
 
     @property
     def vbrange(self):
@@ -3,7 +3,7 @@ from functools import partial
 
 import pandas as pd
 import pyqtgraph as pg
-from PyQt5 import QtGui, QtWidgets
+from PyQt5 import QtWidgets
 
 from graphysio import ui
 from graphysio.algorithms.filters import savgol
@@ -40,12 +40,16 @@ class POISelectorWidget(ui.Ui_POISelectorWidget, QtWidgets.QWidget):
         self.buttonGroup.buttonClicked.connect(buttonClicked)
 
     def loadPOI(self, plotdata):
-        columnname, ok = QtGui.QInputDialog.getItem(
-            self, 'Select POI series', 'Load POI', plotdata.data.columns, editable=False
+        columnname, ok = QtWidgets.QInputDialog.getItem(
+            self, 'Select POI series', 'Load POI', list(plotdata.data), editable=False
         )
         if not ok:
             return
-        poiseries = plotdata.data[columnname].dropna().index
+        poidata = plotdata.data[columnname]
+        if not isinstance(poidata, pd.Series):
+            # Windowed source such as readdata.edf.EdfSource
+            poidata = poidata.series()
+        poiseries = poidata.dropna().index
         self.poiselectorplot.curve.feetitem.addPointsByLocation(
             self.poiselectorplot.pointkey, poiseries
         )
@@ -0,0 +1,102 @@
+from collections.abc import MutableMapping
+
+import numpy as np
+import pandas as pd
+
+
+class POIStore(MutableMapping):
+    # Locations of points of interest by key, as sorted unique int64 arrays,
+    # with the values of the curve at these locations cached alongside.
+    def __init__(self, curve):
+        self.curve = curve
+        self.locations = {}
+        self.values = {}
+        # Series the cached values were taken from
+        self.series = None
+
+    def __getitem__(self, key):
+        return pd.Index(self.locations[key], copy=False)
+
+    def __setitem__(self, key, locations):
+        self.refresh()
+        locations = normalize(locations)
+        self.locations[key] = locations
+        self.values[key] = self.lookup(locations)
+
+    def __delitem__(self, key):
+        del self.locations[key]
+        del self.values[key]
+
+    def __iter__(self):
+        return iter(self.locations)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def lookup(self, locations):
+        # Curve values at locations, NaN where there is no sample
+        index = self.series.index.values
+        if len(index) < 1:
+            return np.full(len(locations), np.nan)
+        pos = np.minimum(np.searchsorted(index, locations), len(index) - 1)
+        found = index[pos] == locations
+        values = np.where(found, self.series.values[pos], np.nan)
+        return values.astype(np.float64)
+
+    def refresh(self):
+        # Take the values again if the curve data was replaced
+        series = self.curve.series
+        if self.series is series:
+            return
+        self.series = series
+        for key, locations in self.locations.items():
+            self.values[key] = self.lookup(locations)
+
+    def yvalues(self, key):
+        self.refresh()
+        return self.values[key]
+
+    def add(self, key, locations):
+        # Insert locations into key, returns those that were not present
+        # along with their values.
+        self.refresh()
+        old = self.locations.get(key, np.array([], dtype=np.int64))
+        oldvalues = self.values.get(key, np.array([], dtype=np.float64))
+        new = normalize(locations)
+        if len(old) > 0:
+            pos = np.minimum(np.searchsorted(old, new), len(old) - 1)
+            new = new[old[pos] != new]
+        newvalues = self.lookup(new)
+        pos = np.searchsorted(old, new)
+        self.locations[key] = np.insert(old, pos, new)
+        self.values[key] = np.insert(oldvalues, pos, newvalues)
+        return (new, newvalues)
+
+    def nearest(self, key, locations):
+        # Positions in key of the points nearest to locations
+        old = self.locations[key]
+        locations = np.asarray(locations)
+        pos = np.searchsorted(old, locations)
+        right = np.minimum(pos, len(old) - 1)
+        left = np.maximum(pos - 1, 0)
+        leftcloser = np.abs(old[left] - locations) <= np.abs(old[right] - locations)
+        return np.where(leftcloser, left, right)
+
+    def remove(self, key, locations):
+        # Remove the points of key nearest to locations
+        if key not in self.locations or len(self.locations[key]) < 1:
+            return
+        nearest = self.nearest(key, locations)
+        self.locations[key] = np.delete(self.locations[key], nearest)
+        self.values[key] = np.delete(self.values[key], nearest)
+
+
+def normalize(locations):
+    # Sorted unique int64 locations without NaN
+    locations = np.asarray(locations)
+    if locations.dtype.kind == 'f':
+        locations = locations[~np.isnan(locations)]
+    locations = locations.astype(np.int64)
+    if len(locations) > 1 and not np.all(np.diff(locations) > 0):
+        locations = np.unique(locations)
+    return locations
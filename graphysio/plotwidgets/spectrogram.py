@@ -1,16 +1,24 @@
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd
 import pyqtgraph as pg
-from pyqtgraph.Qt import QtCore, QtWidgets
+from pyqtgraph.Qt import QtCore, QtGui, QtWidgets
 
 from graphysio import dialogs
+from graphysio.algorithms import spectrum
+from graphysio.plotwidgets.plotwidget import TimeAxisItem
 from graphysio.structures import Parameter, PlotData
 
 
 class SpectrogramWidget(QtWidgets.QWidget):
-    def __init__(self, series, Fs, s_chunklen, parent=None):
+    def __init__(self, series, Fs, s_chunklen, parent=None, overlap=0, naverage=1):
         super().__init__(parent=parent)
-        self.spectro = SpectrogramPlotWidget(series, Fs, s_chunklen, parent)
+        self.spectro = SpectrogramPlotWidget(
+            series, Fs, s_chunklen, parent, overlap=overlap, naverage=naverage
+        )
         self.loslider = QtWidgets.QSlider()
         self.hislider = QtWidgets.QSlider()
         layout = QtWidgets.QHBoxLayout()
@@ -36,52 +44,83 @@ class SpectrogramWidget(QtWidgets.QWidget):
         return {'Plot': mplot}
 
 
-class SpectroTimeAxisItem(pg.AxisItem):
-    def __init__(self, initvalue, samplerate, chunksize, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.initvalue = initvalue / 1e6  # ns to ms
-        self.samplerate = samplerate
-        self.chunksize = chunksize
+# PSD images larger than this are memory mapped to a temporary file
+MAXIMAGE = 2 ** 28  # bytes
+
+# The image is made of tiles of TILESIZE columns computed at window lengths
+# from 2 ** -NFINER to 2 ** NCOARSER times the requested one.
+TILESIZE = 256
+NFINER = 3
+NCOARSER = 4
+MINWINSIZE = 16
+TILECACHE = 2 ** 28  # bytes
+
 
-    def tickStrings(self, values, scale, spacing):
-        ret = []
-        value_to_time = self.chunksize / self.samplerate + self.initvalue
-        for value in values:
-            value = 1e3 * value  # s to ms
-            value = value * value_to_time
-            date = QtCore.QDateTime.fromMSecsSinceEpoch(value)
-            date = date.toTimeSpec(QtCore.Qt.UTC)
-            datestr = date.toString("dd/MM/yyyy\nhh:mm:ss.zzz")
-            ret.append(datestr)
-        return ret
+class Resolution:
+    # Window geometry of one level of the tiled spectrogram
+    def __init__(self, series, Fs, winsize, overlap, naverage):
+        self.winsize = winsize
+        self.step = max(int(round(winsize * (1 - overlap))), 1)
+        self.naverage = naverage
+        self.taper = np.hanning(winsize)
+        self.ncolumns = spectrum.columnCount(len(series), winsize, self.step, naverage)
+        self.ntiles = -(-self.ncolumns // TILESIZE)
+        # Column width in ns and left edge of the first column
+        self.hop = 1e9 * self.step * naverage / Fs
+        self.origin = 0
+        if self.ncolumns > 0:
+            centre = spectrum.columnCentres(series, winsize, self.step, naverage, 1)
+            self.origin = centre[0] - self.hop / 2
+
+    def tileRange(self, xmin, xmax):
+        first = int((xmin - self.origin) // self.hop) // TILESIZE
+        last = int((xmax - self.origin) // self.hop) // TILESIZE
+        return range(max(first, 0), min(last, self.ntiles - 1) + 1)
 
 
 # To set:
 # levels
 # color gradient
 class SpectrogramPlotWidget(pg.PlotWidget):
-    def __init__(self, series, Fs, s_chunklen, parent=None):
-        # s_chunklen in seconds
+    tileReady = QtCore.pyqtSignal(object, object)
+
+    def __init__(self, series, Fs, s_chunklen, parent=None, overlap=0, naverage=1):
+        # s_chunklen in seconds, overlap as a fraction of the window. series
+        # can also be a windowed source such as readdata.edf.EdfSource.
         self.name = series.name
         self.parent = parent
-        self.origidx = series.index.values
+        self.series = series
 
         self.fs = Fs
-        self.data = series.values
         self.chunksize = int(s_chunklen * Fs)
+        self.step = max(int(round(self.chunksize * (1 - overlap))), 1)
+        self.naverage = max(int(naverage), 1)
         self.win = np.hanning(self.chunksize)
+        self.psd = None
 
-        axisItem = SpectroTimeAxisItem(
-            initvalue=self.origidx[0],
-            samplerate=self.fs,
-            chunksize=self.chunksize,
-            orientation='bottom',
+        self.resolutions = []
+        for k in range(-NFINER, NCOARSER + 1):
+            winsize = int(round(self.chunksize * 2.0 ** k))
+            if k != 0 and (winsize < MINWINSIZE or winsize > len(series)):
+                continue
+            res = Resolution(series, Fs, winsize, overlap, self.naverage)
+            self.resolutions.append(res)
+
+        # Colour levels shared by all resolutions, from the requested one
+        self.colorlevels = spectrum.sampledLevels(
+            series, self.chunksize, self.step, self.naverage, self.win
         )
-        axisItems = {'bottom': axisItem}
-        super().__init__(parent=self.parent, axisItems=axisItems)
+        self.tiles = OrderedDict()
+        self.tilebytes = 0
+        self.tileitems = {}
+        self.pending = set()
+        self.wanted = set()
+        self.executor = getattr(parent, 'executor', None)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor()
 
-        self.img = pg.ImageItem()
-        self.addItem(self.img)
+        axisItems = {'bottom': TimeAxisItem(orientation='bottom')}
+        super().__init__(parent=self.parent, axisItems=axisItems)
         self.setLabel('left', 'Frequency', units='Hz')
 
         # bipolar colormap
@@ -97,44 +136,48 @@ class SpectrogramPlotWidget(pg.PlotWidget):
             dtype=np.ubyte,
         )
         cmap = pg.ColorMap(pos, color)
-        lut = cmap.getLookupTable(0.0, 1.0, 256)
-        self.img.setLookupTable(lut)
+        self.lut = cmap.getLookupTable(0.0, 1.0, 256)
 
-        self.calculate_psd()
-        self.render()
+        self.tileReady.connect(self.storeTile)
+        vb = self.getViewBox()
+        vb.sigXRangeChanged.connect(self.updateTiles)
+        vb.sigResized.connect(self.updateTiles)
+        coarsest = self.resolutions[-1]
+        xmin = coarsest.origin
+        xmax = xmin + max(coarsest.ncolumns, 1) * coarsest.hop
+        self.setYRange(0, Fs / 2, padding=0)
+        self.setXRange(xmin, xmax, padding=0)
+        self.updateTiles()
 
-    def idx_to_hz(self, idxval):
-        conv = self.fs / self.chunksize
-        return conv * idxval
+    @property
+    def freqs(self):
+        return np.fft.rfftfreq(self.chunksize, 1 / self.fs)
 
     def calcsef(self, perc):
-        buf = np.zeros(self.psd.shape[0])
-        psdcs = np.cumsum(self.psd, axis=1)
-        for i, columncs in enumerate(psdcs):
-            thres = perc * columncs[-1] / 100
-            sefidx = np.where(columncs > thres)
-            try:
-                buf[i] = self.idx_to_hz(sefidx[0][0])
-            except IndexError:
-                pass
-        return buf
+        self.calculate_psd()
+        return spectrum.spectralEdge(self.psd, self.freqs, perc)
 
     def calculate_psd(self):
-        nsplit = int(len(self.data) / self.chunksize)
-        chunks = self.data[0 : nsplit * self.chunksize]
-        chunks = np.split(chunks, nsplit)
-        chunks = np.vstack(chunks)
-        spec = np.fft.rfft(chunks * self.win) / self.chunksize
-        self.psd = np.real(spec) ** 2
+        # Full PSD at the requested window length
+        if self.psd is not None:
+            return
+        ncolumns = spectrum.columnCount(
+            len(self.series), self.chunksize, self.step, self.naverage
+        )
+        nbytes = 4 * ncolumns * (self.chunksize // 2 + 1)
+        self.psdfile = tempfile.TemporaryFile() if nbytes > MAXIMAGE else None
+        self.psd = spectrum.psdBuffer(ncolumns, self.chunksize, self.psdfile)
+        spectrum.spectrogram(
+            self.series, self.chunksize, self.step, self.naverage, self.win, self.psd
+        )
 
     def genIndex(self):
-        nwindows = self.psd.shape[0]
-        winsize = self.chunksize
-        windows = np.lib.stride_tricks.as_strided(
-            self.origidx, shape=(nwindows, winsize)
+        ncolumns = spectrum.columnCount(
+            len(self.series), self.chunksize, self.step, self.naverage
+        )
+        return spectrum.columnCentres(
+            self.series, self.chunksize, self.step, self.naverage, ncolumns
         )
-        result = np.apply_along_axis(np.mean, 1, windows)
-        return result.astype(int)
 
     def launchSEFExtract(self):
         q = Parameter('SEF percentage', int)
@@ -148,12 +191,103 @@ class SpectrogramPlotWidget(pg.PlotWidget):
         plotdata = PlotData(data, name=curvename)
         self.parent.createNewPlotWithData(plotdata)
 
+    def pickLevel(self, span, npixels):
+        # Finest resolution with at most one column per pixel in view
+        for level, res in enumerate(self.resolutions):
+            if span / res.hop <= npixels:
+                return level
+        return len(self.resolutions) - 1
+
+    def updateTiles(self, *args):
+        vb = self.getViewBox()
+        (xmin, xmax), _ = vb.viewRange()
+        npixels = max(int(vb.width()), 1)
+        level = self.pickLevel(xmax - xmin, npixels)
+        res = self.resolutions[level]
+        self.wanted = {(level, t) for t in res.tileRange(xmin, xmax)}
+        for key in self.wanted:
+            if key in self.tiles:
+                self.tiles.move_to_end(key)
+            elif key not in self.pending:
+                self.pending.add(key)
+                future = self.executor.submit(self.computeTile, key)
+                future.add_done_callback(self.tileCallback(key))
+        self.render()
+
+    def tileCallback(self, key):
+        def cb(future):
+            try:
+                psd = future.result()
+            except Exception as e:
+                # Exceptions raised in done callbacks are only logged
+                psd = e
+            self.tileReady.emit(key, psd)
+
+        return cb
+
+    def computeTile(self, key):
+        # Runs in the thread pool. Skip tiles scrolled out of view meanwhile.
+        if key not in self.wanted:
+            return None
+        level, t = key
+        res = self.resolutions[level]
+        begin = t * TILESIZE
+        end = min(begin + TILESIZE, res.ncolumns)
+        psd = spectrum.psdColumns(
+            self.series, res.winsize, res.step, res.naverage, res.taper, begin, end
+        )
+        # Same power density as the requested window length so that the
+        # colour levels hold at every resolution
+        psd *= res.winsize / self.chunksize
+        return psd.astype(np.float32)
+
+    def storeTile(self, key, psd):
+        self.pending.discard(key)
+        if isinstance(psd, Exception):
+            # Tried again when the view changes
+            lblStatus = getattr(self.parent, 'lblStatus', None)
+            if lblStatus is not None:
+                lblStatus.setText(f'Spectrogram tile failed: {psd}')
+            return
+        if psd is None:
+            if key in self.wanted:
+                self.updateTiles()
+            return
+        self.tiles[key] = psd
+        self.tilebytes += psd.nbytes
+        while self.tilebytes > TILECACHE and len(self.tiles) > 1:
+            _, old = self.tiles.popitem(last=False)
+            self.tilebytes -= old.nbytes
+        self.render()
+
     def render(self):
-        # TODO make lo / hi adjustable
-        psdnona = self.psd[~np.isnan(self.psd)]
-        hi = np.percentile(psdnona, 95)
-        lo = np.percentile(psdnona, 5)
-        # print(f'PSD Lo: {lo}, Hi: {hi}')
-        self.img.scale(1, self.fs / self.chunksize)
-        self.img.setLevels([lo, hi])
-        self.img.setImage(self.psd, autoLevels=False)
+        # Tiles of the previous view stay below until the new ones are ready
+        complete = all(key in self.tiles for key in self.wanted)
+        for key, item in list(self.tileitems.items()):
+            if key in self.wanted:
+                continue
+            if complete:
+                self.removeItem(item)
+                del self.tileitems[key]
+            else:
+                item.setZValue(-1)
+        for key in self.wanted:
+            if key in self.tileitems or key not in self.tiles:
+                continue
+            item = self.tileItem(key)
+            self.addItem(item)
+            self.tileitems[key] = item
+
+    def tileItem(self, key):
+        level, t = key
+        res = self.resolutions[level]
+        item = pg.ImageItem()
+        item.setLookupTable(self.lut)
+        item.setImage(self.tiles[key], autoLevels=False)
+        item.setLevels(self.colorlevels)
+        # Columns in ns centred on the samples they cover, rows in Hz
+        tr = QtGui.QTransform()
+        tr.translate(res.origin + t * TILESIZE * res.hop, 0)
+        tr.scale(res.hop, self.fs / res.winsize)
+        item.setTransform(tr)
+        return item
@@ -3,11 +3,10 @@ from functools import partial
 
 import pandas as pd
 import pyqtgraph as pg
-import sympy
 from pyqtgraph.Qt import QtCore, QtGui
 
 from graphysio import dialogs, transformations
-from graphysio.algorithms import filters
+from graphysio.algorithms import align, expressions, filters, pipeline, segments
 from graphysio.plotwidgets import (
     LoopWidget,
     PlotWidget,
@@ -36,25 +35,32 @@ class TSWidget(PlotWidget):
         )
 
     def filterCurve(self, oldcurve, filtername, asnew=False):
-        newseries, newsamplerate = filters.filter(
-            oldcurve, filtername, dialogs.askUserValue
-        )
+        step = filters.askStep(filtername, dialogs.askUserValue)
+        filterpipeline, steps = pipeline.forCurve(oldcurve)
+        steps = steps + [step]
+        newseries, newsamplerate = filterpipeline.run(steps)
+        stepname, parameters = step
+        if stepname == 'expression':
+            (formula,) = parameters
+            compiled = expressions.compileExpression(formula, ['x'], False)
+            self.parent.lblStatus.setText(f'{formula}: {compiled.timings()}')
         if asnew:
             newname = self.validateNewCurveName(newseries.name)
             if newname != newseries.name:
                 newseries = newseries.rename(newname)
-            newcurve = self.addSeriesAsCurve(series=newseries)
-            newcurve.samplerate = newsamplerate
+            isnew = newseries.name not in self.curves
+            curve = self.addSeriesAsCurve(series=newseries, samplerate=newsamplerate)
+            if isnew and curve is not None:
+                pipeline.attach(curve, filterpipeline, steps)
         else:
-            newseries = newseries.rename(oldcurve.series.name)
-            newseries = newseries.dropna()
-            if len(newseries) < 1:
+            newseries = newseries.rename(oldcurve.name())
+            if newseries.count() < 1:
                 return
-            newseries = newseries.groupby(newseries.index).mean()
             oldcurve.clear()
-            oldcurve.series = newseries
-            oldcurve.samplerate = newsamplerate
+            oldcurve.load(newseries, newsamplerate)
             oldcurve.render()
+            steps.append(('rename', (newseries.name,)))
+            pipeline.attach(oldcurve, filterpipeline, steps)
 
     def filterFeet(self, curve, filtername, asnew=False):
         feetdict = curve.feetitem.indices
@@ -129,11 +135,7 @@ class TSWidget(PlotWidget):
     def setDateTime(self):
         if len(self.curves) < 1:
             return
-        sortedcurves = sorted(
-            self.curves.values(), key=lambda curve: curve.series.index[0]
-        )
-        fstcurve = sortedcurves[0]
-        curtimestamp = fstcurve.series.index[0]
+        curtimestamp = min(curve.begin() for curve in self.curves.values())
         dlg = dialogs.DlgSetDateTime(prevdatetime=curtimestamp)
         dlg.exec_()
         newtimestamp = dlg.dlgdata
@@ -141,7 +143,7 @@ class TSWidget(PlotWidget):
             return
         offset = newtimestamp - curtimestamp
         for curve in self.curves.values():
-            curve.series.index += offset
+            curve.shift(offset)
             curve.render()
 
     def launchTransformation(self):
@@ -176,9 +178,27 @@ class TSWidget(PlotWidget):
         window = dialogs.askUserValue(q)
         if not curvename:
             return
+        q = Parameter('Overlap between windows (%)', int)
+        overlap = dialogs.askUserValue(q) or 0
+        overlap = min(max(overlap, 0), 99) / 100
+        q = Parameter('Windows averaged per column', int)
+        naverage = dialogs.askUserValue(q) or 1
         curve = self.curves[curvename]
+        # Read lazy curves by blocks rather than loading them whole
+        signal = getattr(curve, 'source', None)
+        if signal is None:
+            signal = curve.series
+            if len(curve.segments) > 1:
+                # Gaps are read as NaN so that no window spans them and the
+                # columns stay evenly spaced in time
+                signal = segments.UniformView(signal, curve.segments, curve.samplerate)
         spectro = SpectrogramWidget(
-            curve.series, curve.samplerate, window, parent=self.parent
+            signal,
+            curve.samplerate,
+            window,
+            parent=self.parent,
+            overlap=overlap,
+            naverage=naverage,
         )
         self.parent.addTab(spectro, curve.name())
 
@@ -187,22 +207,32 @@ class TSWidget(PlotWidget):
         dlgCurveAlgebra = dialogs.DlgCurveAlgebra(self, curvecorr)
 
         def cb(formula):
-            expr = sympy.sympify(formula)
-            symbols = list(expr.free_symbols)
-            schar = sorted([str(x) for x in symbols])
-            curvenames = [curvecorr[x] for x in schar]
-            sers = [self.curves[c].series for c in curvenames]
-            if len(sers) < 1:
+            compiled = expressions.compileExpression(formula)
+            curvenames = [curvecorr[x] for x in compiled.symbols]
+            curves = [self.curves[c] for c in curvenames]
+            if len(curves) < 1:
                 # Scalar
                 return
-            df = pd.concat(sers, axis=1, keys=[s.name for s in sers])
-            df = df.dropna(how='all').interpolate()
-            args = [df[c].values for c in curvenames]
-            l = sympy.lambdify(symbols, expr, 'numpy')
-            newvals = l(*args)
+            choice = align.Timebases[0]
+            rate = None
+            if len(curves) > 1:
+                q = Parameter('Evaluate on the timebase of', align.Timebases)
+                choice = dialogs.askUserValue(q)
+                if choice is None:
+                    return
+                if choice == 'Explicit rate':
+                    rate = dialogs.askUserValue(Parameter('Sampling rate (Hz)', float))
+                    if not rate:
+                        return
+            sers = [curve.series for curve in curves]
+            samplerates = [curve.samplerate for curve in curves]
+            index, samplerate = align.timebase(sers, samplerates, choice, rate)
+            args = [align.valuesAt(series, index) for series in sers]
+            newvals = compiled(*args)
+            self.parent.lblStatus.setText(f'{formula}: {compiled.timings()}')
             newname = self.validateNewCurveName(formula, True)
-            newseries = pd.Series(newvals, index=df.index, name=newname, dtype='double')
-            self.addSeriesAsCurve(newseries)
+            newseries = pd.Series(newvals, index=index, name=newname, dtype='double')
+            self.addSeriesAsCurve(newseries, samplerate=samplerate)
 
         dlgCurveAlgebra.dlgdata.connect(cb)
         dlgCurveAlgebra.exec_()
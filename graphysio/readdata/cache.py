@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Optional
+
+import attr
+import numpy as np
+import pandas as pd
+
+# Parsed CSV files are stored as one .npy file per column so that they can be
+# memory mapped back. Least recently used entries are evicted above MAXSIZE.
+CACHEDIR = os.path.join(os.path.expanduser('~'), '.cache', 'graphysio', 'csv')
+MAXSIZE = 2 * 2 ** 30  # bytes
+METAFILE = 'meta.json'
+
+
+def cacheKey(request) -> str:
+    # Content address from the file identity and all the parsing options
+    filepath = os.path.realpath(request.filepath)
+    stat = os.stat(filepath)
+    options = attr.asdict(request)
+    options['filepath'] = filepath
+    ident = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'options': options}
+    serialized = json.dumps(ident, sort_keys=True, default=str)
+    return hashlib.sha1(serialized.encode('utf8')).hexdigest()
+
+
+def load(request) -> Optional[pd.DataFrame]:
+    entry = os.path.join(CACHEDIR, cacheKey(request))
+    metapath = os.path.join(entry, METAFILE)
+    try:
+        with open(metapath, 'r') as f:
+            meta = json.load(f)
+        # Copy on write so that the curves can still be modified in place
+        index = np.load(os.path.join(entry, 'index.npy'), mmap_mode='c')
+        columns = {
+            name: np.load(os.path.join(entry, f'{n}.npy'), mmap_mode='c')
+            for n, name in enumerate(meta['columns'])
+        }
+    except (OSError, ValueError, KeyError):
+        return None
+    # Mark as recently used
+    os.utime(metapath)
+    # One block per column, consolidating would copy the maps into memory
+    return pd.DataFrame(columns, index=index, columns=meta['columns'], copy=False)
+
+
+def store(request, data: pd.DataFrame) -> None:
+    if data.memory_usage(index=True).sum() > MAXSIZE:
+        # Would be evicted right away
+        return
+    key = cacheKey(request)
+    entry = os.path.join(CACHEDIR, key)
+    tmpentry = os.path.join(CACHEDIR, f'{key}.tmp{os.getpid()}')
+    try:
+        os.makedirs(tmpentry, exist_ok=True)
+        np.save(os.path.join(tmpentry, 'index.npy'), data.index.to_numpy())
+        for n, name in enumerate(data.columns):
+            np.save(os.path.join(tmpentry, f'{n}.npy'), data[name].to_numpy())
+        meta = {'columns': list(data.columns), 'filepath': str(request.filepath)}
+        with open(os.path.join(tmpentry, METAFILE), 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmpentry, entry)
+    except (OSError, TypeError, ValueError):
+        # Caching is best effort
+        shutil.rmtree(tmpentry, ignore_errors=True)
+        return
+    evict()
+
+
+def entrySize(entry) -> int:
+    return sum(e.stat().st_size for e in os.scandir(entry) if e.is_file())
+
+
+def evict(maxsize: int = MAXSIZE) -> None:
+    entries = []
+    for e in os.scandir(CACHEDIR):
+        try:
+            lastused = os.stat(os.path.join(e.path, METAFILE)).st_mtime
+        except OSError:
+            # Incomplete entry, possibly being written
+            continue
+        entries.append((lastused, entrySize(e.path), e.path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= maxsize:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def purge() -> None:
+    shutil.rmtree(CACHEDIR, ignore_errors=True)
@@ -1,4 +1,9 @@
 import csv
+import io
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 from typing import List
 
@@ -8,9 +13,13 @@ from attr import attrib, attrs
 from pyqtgraph.Qt import QtCore, QtGui, QtWidgets
 
 from graphysio import ui
+from graphysio.readdata import cache, timestamps
 from graphysio.readdata.baseclass import BaseReader
 from graphysio.structures import PlotData
 
+# Size of the byte ranges parsed in parallel for large files
+CHUNKSIZE = 64 * 2 ** 20  # bytes
+
 
 class CsvReader(BaseReader):
     def askUserInput(self):
@@ -23,55 +32,10 @@ class CsvReader(BaseReader):
 
     def __call__(self) -> List[PlotData]:
         request = self.userdata['csvrequest']
-        data = pd.read_csv(
-            request.filepath,
-            sep=request.seperator,
-            usecols=request.fields,
-            decimal=request.decimal,
-            skiprows=request.droplines,
-            encoding=request.encoding,
-            index_col=False,
-            engine='c',
-        )
-        pdtonum = partial(pd.to_numeric, errors='coerce')
-        dtformat = request.datetime_format
-        if request.generatex:
-            data.index = (1e9 * data.index / request.samplerate).astype(np.int64)
-            # Make all data numeric and remove empty rows
-            data = data.apply(pdtonum)
-            data = data.dropna(axis='rows', how='all')
-        else:
-            timestamp = data[request.dtfield]
-            data = data.drop(columns=request.dtfield)
-            # Force all columns to numeric
-            data = data.apply(pdtonum)
-
-            if dtformat == '<seconds>':
-                timestamp = pdtonum(timestamp)
-                timestamp = pd.to_datetime(timestamp * 1e9, unit='ns')
-            elif dtformat == '<milliseconds>':
-                timestamp = pdtonum(timestamp)
-                timestamp = pd.to_datetime(timestamp * 1e6, unit='ns')
-            elif dtformat == '<microseconds>':
-                timestamp = pdtonum(timestamp)
-                timestamp = pd.to_datetime(timestamp * 1e3, unit='ns')
-            elif dtformat == '<nanoseconds>':
-                timestamp = pdtonum(timestamp)
-                timestamp = pd.to_datetime(timestamp, unit='ns')
-            elif dtformat == '<infer>':
-                timestamp = pd.to_datetime(timestamp, infer_datetime_format=True)
-            else:
-                timestamp = pd.to_datetime(timestamp, format=dtformat)
-
-            # Convert timestamp to UTC and use as index
-            timestamp = (
-                pd.Index(timestamp).tz_localize(request.timezone).tz_convert('UTC')
-            )
-            timestamp = timestamp.astype(np.int64)
-            data = data.set_index([timestamp])
-
-        data = data.dropna(axis='columns', how='all')
-        data = data.sort_index()
+        data = cache.load(request)
+        if data is None:
+            data = readParsed(request)
+            cache.store(request, data)
 
         fp = request.filepath
         if request.clusterid:
@@ -85,11 +49,247 @@ class CsvReader(BaseReader):
                 for i, df in g
             )
         else:
-            plotdata = [PlotData(data=data, filepath=fp)]
+            samplerates = {}
+            if request.generatex:
+                samplerates = {name: request.samplerate for name in data}
+            plotdata = [PlotData(data=data, filepath=fp, samplerates=samplerates)]
 
         return plotdata
 
 
+def readParsed(request) -> pd.DataFrame:
+    chunked = (
+        os.path.getsize(request.filepath) > 2 * CHUNKSIZE
+        and '\n'.encode(request.encoding) == b'\n'
+        and not hasQuotes(request.filepath)
+    )
+    if chunked:
+        data = readChunked(request)
+    else:
+        data = readWhole(request)
+
+    data = data.dropna(axis='columns', how='all')
+    if not data.index.is_monotonic_increasing:
+        data = data.sort_index()
+    return data
+
+
+def readCsv(request, filepath_or_buffer, **kwargs):
+    options = {
+        'sep': request.seperator,
+        'usecols': request.fields,
+        'decimal': request.decimal,
+        'encoding': request.encoding,
+        'index_col': False,
+        'engine': 'c',
+    }
+    options.update(kwargs)
+    return pd.read_csv(filepath_or_buffer, **options)
+
+
+def generateIndex(nrows, samplerate):
+    return (1e9 * np.arange(nrows) / samplerate).astype(np.int64)
+
+
+# Epoch timestamps given as numbers, with the number of ns per unit
+NUMERICUNITS = {
+    '<seconds>': 10 ** 9,
+    '<milliseconds>': 10 ** 6,
+    '<microseconds>': 10 ** 3,
+    '<nanoseconds>': 1,
+}
+# Integers from this magnitude on are not exact in float64
+MAXEXACT = 2 ** 53
+
+
+def numbersToNs(numbers, unitns):
+    # Epoch ns are around 1.6e18, float64 only holds them to 256 ns. Whole
+    # units are scaled in int64 and float64 only carries the fraction.
+    # Invalid values become NaT.
+    numbers = pd.Series(numbers)
+    parsed = pd.to_numeric(numbers, errors='coerce')
+    if parsed.dtype.kind in 'iu':
+        return parsed.to_numpy(dtype=np.int64) * unitns
+    values = parsed.to_numpy(dtype=np.float64)
+    ns = np.full(len(values), np.iinfo(np.int64).min)
+    finite = np.isfinite(values)
+    whole = np.floor(values[finite])
+    frac = np.round((values[finite] - whole) * unitns)
+    ns[finite] = whole.astype(np.int64) * unitns + frac.astype(np.int64)
+    if numbers.dtype == object:
+        # Integers as text next to invalid rows were parsed as float, those
+        # too large to be exact are read again from their text
+        (inexact,) = (finite & (np.abs(values) >= MAXEXACT)).nonzero()
+        text = numbers.iloc[inexact].astype(str)
+        try:
+            ns[inexact] = text.astype(np.int64).to_numpy() * unitns
+        except (ValueError, OverflowError):
+            # Not all in integer notation
+            isint = text.str.fullmatch(r'\s*[+-]?\d+\s*').to_numpy()
+            ns[inexact[isint]] = text[isint].astype(np.int64).to_numpy() * unitns
+    return ns
+
+
+def convertTimestamps(timestamp, request):
+    dtformat = request.datetime_format
+    if dtformat in NUMERICUNITS:
+        ns = numbersToNs(timestamp, NUMERICUNITS[dtformat])
+        timestamp = pd.to_datetime(ns, unit='ns')
+    else:
+        # Fast path for common fixed width layouts, directly to UTC ns
+        if dtformat == '<infer>':
+            wallns = timestamps.parseInfer(timestamp)
+        else:
+            wallns = timestamps.parseFixedWidth(timestamp, dtformat)
+        if wallns is not None:
+            return timestamps.localToUtc(wallns, request.timezone)
+        elif dtformat == '<infer>':
+            timestamp = pd.to_datetime(timestamp, infer_datetime_format=True)
+        else:
+            timestamp = pd.to_datetime(timestamp, format=dtformat)
+
+    # Convert timestamp to UTC
+    timestamp = pd.Index(timestamp).tz_localize(request.timezone).tz_convert('UTC')
+    return timestamp.asi8
+
+
+def convertChunk(data, request):
+    # Force all columns to numeric and extract the timestamps if any
+    pdtonum = partial(pd.to_numeric, errors='coerce')
+    if request.generatex:
+        timestamp = None
+    else:
+        timestamp = convertTimestamps(data[request.dtfield], request)
+        data = data.drop(columns=request.dtfield)
+    data = data.apply(pdtonum)
+    return (timestamp, data)
+
+
+def readWhole(request):
+    data = readCsv(request, request.filepath, skiprows=request.droplines)
+    timestamp, data = convertChunk(data, request)
+    if request.generatex:
+        data.index = generateIndex(len(data), request.samplerate)
+        # Remove empty rows
+        data = data.dropna(axis='rows', how='all')
+    else:
+        data = data.set_index([timestamp])
+    return data
+
+
+def readChunk(request, header, columns, begin, end):
+    # Parse the lines in the byte range [begin, end) of the file
+    with open(request.filepath, 'rb') as f:
+        f.seek(begin)
+        raw = f.read(end - begin)
+    data = readCsv(request, io.BytesIO(raw), header=None, names=header)
+    timestamp, data = convertChunk(data, request)
+    return (timestamp, data[columns].to_numpy(dtype=np.float64))
+
+
+def hasQuotes(filepath):
+    # Quoted fields can hold line breaks, which the byte ranges of readChunked
+    # would split. Only the beginning of the file is checked, files with
+    # quotes further on only are not supported.
+    with open(filepath, 'rb') as f:
+        return b'"' in f.read(CHUNKSIZE)
+
+
+def chunkBoundaries(filepath, datastart):
+    # Split the file in byte ranges of about CHUNKSIZE ending on a line break
+    filesize = os.path.getsize(filepath)
+    boundaries = [datastart]
+    with open(filepath, 'rb') as f:
+        while boundaries[-1] < filesize:
+            f.seek(boundaries[-1] + CHUNKSIZE)
+            f.readline()
+            boundaries.append(min(f.tell(), filesize))
+    return boundaries
+
+
+def growRows(array, size):
+    grown = np.empty((size,) + array.shape[1:], dtype=array.dtype)
+    grown[: len(array)] = array
+    return grown
+
+
+def boundedMap(executor, func, args, maxpending):
+    # Like executor.map but keeps at most maxpending results waiting in memory
+    pending = deque()
+    args = iter(args)
+    while True:
+        for arg in itertools.islice(args, maxpending - len(pending)):
+            pending.append(executor.submit(func, *arg))
+        if not pending:
+            return
+        yield pending.popleft().result()
+
+
+def readChunked(request):
+    # Header as parsed by pandas, and position of the first data line
+    header = readCsv(
+        request, request.filepath, skiprows=request.droplines, nrows=0, usecols=None
+    ).columns
+    with open(request.filepath, 'rb') as f:
+        for _ in range(request.droplines + 1):
+            f.readline()
+        datastart = f.tell()
+    columns = [c for c in header if c in request.fields and c != request.dtfield]
+
+    boundaries = chunkBoundaries(request.filepath, datastart)
+    databytes = boundaries[-1] - datastart
+
+    # Write the chunks into buffers in file order. They are sized from the
+    # rows per byte of the first chunk, and grown if that falls short.
+    nrows = 0
+    values = index = None
+
+    def store(result):
+        nonlocal nrows, values, index
+        timestamp, chunk = result
+        n = len(chunk)
+        if values is None:
+            chunkbytes = boundaries[1] - boundaries[0]
+            size = int(1.1 * n * databytes / chunkbytes) + n
+            values = np.empty((size, len(columns)), dtype=np.float64)
+            index = np.empty(size, dtype=np.int64)
+        elif nrows + n > len(values):
+            size = max(nrows + n, len(values) * 3 // 2)
+            values = growRows(values, size)
+            index = growRows(index, size)
+        values[nrows : nrows + n] = chunk
+        if timestamp is not None:
+            index[nrows : nrows + n] = timestamp
+        nrows += n
+
+    args = [
+        (request, header, columns, b, e) for b, e in zip(boundaries, boundaries[1:])
+    ]
+    nworkers = os.cpu_count() or 1
+    if nworkers > 1 and len(args) > 1:
+        with ProcessPoolExecutor(nworkers) as executor:
+            for result in boundedMap(executor, readChunk, args, 2 * nworkers):
+                store(result)
+    else:
+        for result in itertools.starmap(readChunk, args):
+            store(result)
+
+    if values is None:
+        values = np.empty((0, len(columns)), dtype=np.float64)
+        index = np.empty(0, dtype=np.int64)
+    if request.generatex:
+        index = generateIndex(nrows, request.samplerate)
+    data = pd.DataFrame(values[:nrows], index=index[:nrows], columns=columns)
+    if request.generatex:
+        # Remove empty rows
+        data = data.dropna(axis='rows', how='all')
+    if request.clusterid:
+        data[request.clusterid] = pd.to_numeric(
+            data[request.clusterid], downcast='integer'
+        )
+    return data
+
+
 @attrs
 class CsvRequest:
     filepath = attrib()
@@ -1,3 +1,7 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
 import numpy as np
 import pandas as pd
 import pyedflib
@@ -6,17 +10,26 @@ from graphysio.dialogs import DlgListChoice
 from graphysio.readdata.baseclass import BaseReader
 from graphysio.structures import PlotData
 
+# Channels longer than LAZYSAMPLES are decoded on demand by blocks
+LAZYSAMPLES = 2 ** 23
+BLOCKSIZE = 2 ** 16
+MAXBLOCKS = 32
+SUMMARYSIZE = 64
+# Sources can be read from worker threads, e.g. for spectrogram tiles. A file
+# can only be opened once at a time, it is opened under READLOCK.
+READLOCK = threading.RLock()
+
 
 class EdfReader(BaseReader):
     def askUserInput(self):
         filepath = str(self.userdata['filepath'])
-        edf = pyedflib.EdfReader(filepath)
-
         signals = {}
-        for i in range(edf.signals_in_file):
-            h = edf.getSignalHeader(i)
-            signals[h['label']] = i
-        edf.close()
+        with READLOCK:
+            edf = pyedflib.EdfReader(filepath)
+            for i in range(edf.signals_in_file):
+                h = edf.getSignalHeader(i)
+                signals[h['label']] = i
+            edf.close()
 
         def cb(colnames):
             self.userdata['columns'] = [signals[lbl] for lbl in colnames]
@@ -28,23 +41,186 @@ class EdfReader(BaseReader):
 
     def __call__(self) -> PlotData:
         filepath = str(self.userdata['filepath'])
-        edf = pyedflib.EdfReader(filepath)
+        with READLOCK:
+            edf = pyedflib.EdfReader(filepath)
+            try:
+                return self.read(filepath, edf)
+            finally:
+                edf.close()
+
+    def read(self, filepath, edf):
         beginns = edf.getStartdatetime().timestamp() * 1e9
         nsamplesPerChannel = edf.getNSamples()
 
-        signals = []
+        # One series per channel at its native rate, mixed rates would
+        # otherwise produce a NaN padded union index. Long channels are not
+        # read here but decoded on demand.
+        signals = {}
+        samplerates = {}
         for i in self.userdata['columns']:
-            h = edf.getSignalHeader(i)
-            fs = h['sample_rate']
             n = nsamplesPerChannel[i]
+            if n > LAZYSAMPLES:
+                s = EdfSource(edf, i)
+                signals[s.name] = s
+                continue
+            h = edf.getSignalHeader(i)
+            fs = edf.getSampleFrequency(i)
             endns = beginns + n * 1e9 / fs
             idx = np.linspace(beginns, endns, num=n, dtype=np.int64)
             s = pd.Series(edf.readSignal(i), index=idx, name=h['label'])
-            signals.append(s)
-        edf.close()
+            signals[s.name] = s
+            samplerates[s.name] = fs
 
         if not signals:
             return None
 
-        df = pd.concat(signals, axis=1)
-        return PlotData(data=df, filepath=filepath)
+        return PlotData(data=signals, filepath=filepath, samplerates=samplerates)
+
+
+class EdfSource:
+    # Windowed access to one EDF channel. Samples are decoded by blocks on
+    # demand and the most recently used blocks are kept in memory. The min and
+    # max of every summarysize samples are kept for all decoded blocks.
+    # Metadata is taken from the open edf, the file is then only open while
+    # reading so that it can be opened again, e.g. to load other channels.
+    def __init__(self, edf, channel, blocksize=BLOCKSIZE, maxblocks=MAXBLOCKS):
+        self.filepath = edf.file_name
+        self.edf = None
+        self.channel = channel
+        self.blocksize = blocksize
+        self.maxblocks = maxblocks
+        self.summarysize = SUMMARYSIZE
+        self.name = edf.getLabel(channel)
+        self.samplerate = edf.getSampleFrequency(channel)
+        self.nsamples = edf.getNSamples()[channel]
+        # Same timestamps as np.linspace(begin, end, nsamples)
+        self.begin = edf.getStartdatetime().timestamp() * 1e9
+        self.end = self.begin + self.nsamples * 1e9 / self.samplerate
+        self.blocks = OrderedDict()
+        self.summaries = {}
+
+    def __len__(self):
+        return self.nsamples
+
+    @property
+    def nblocks(self):
+        return -(-self.nsamples // self.blocksize)
+
+    def rename(self, name):
+        self.name = name
+        return self
+
+    def shift(self, offset):
+        self.begin += offset
+        self.end += offset
+
+    def timestamps(self, positions):
+        positions = np.asarray(positions)
+        if self.nsamples < 2:
+            return np.full(len(positions), self.begin, dtype=np.int64)
+        step = (self.end - self.begin) / (self.nsamples - 1)
+        timestamps = positions * step + self.begin
+        timestamps[positions == self.nsamples - 1] = self.end
+        return timestamps.astype(np.int64)
+
+    def position(self, timestamp, side='left'):
+        # Insertion point of timestamp, as searchsorted on the timestamps
+        if self.nsamples < 2:
+            guess = 0
+        else:
+            step = (self.end - self.begin) / (self.nsamples - 1)
+            guess = np.floor((timestamp - self.begin) / step)
+            guess = int(np.clip(guess, 0, self.nsamples - 1))
+        candidates = np.arange(max(guess - 2, 0), min(guess + 3, self.nsamples))
+        timestamps = self.timestamps(candidates)
+        return int(candidates[0] + np.searchsorted(timestamps, timestamp, side=side))
+
+    @contextmanager
+    def opened(self):
+        # The file is kept open until the outermost of nested reads is done
+        with READLOCK:
+            if self.edf is not None:
+                yield self.edf
+                return
+            self.edf = pyedflib.EdfReader(self.filepath)
+            try:
+                yield self.edf
+            finally:
+                self.edf.close()
+                self.edf = None
+
+    def decode(self, b):
+        # Values of block b, whose summary is kept
+        with self.opened() as edf:
+            start = b * self.blocksize
+            n = min(self.blocksize, self.nsamples - start)
+            values = edf.readSignal(self.channel, start, n)
+            if b not in self.summaries:
+                chunks = np.arange(0, n, self.summarysize)
+                mins = np.minimum.reduceat(values, chunks)
+                maxs = np.maximum.reduceat(values, chunks)
+                self.summaries[b] = (mins, maxs)
+            return values
+
+    def block(self, b):
+        with READLOCK:
+            try:
+                self.blocks.move_to_end(b)
+                return self.blocks[b]
+            except KeyError:
+                pass
+            values = self.decode(b)
+            self.blocks[b] = values
+            if len(self.blocks) > self.maxblocks:
+                self.blocks.popitem(last=False)
+            return values
+
+    def read(self, start, stop):
+        # Values of samples [start, stop)
+        start = max(start, 0)
+        stop = min(stop, self.nsamples)
+        if stop <= start:
+            return np.empty(0)
+        first = start // self.blocksize
+        last = (stop - 1) // self.blocksize
+        with self.opened():
+            blocks = [self.block(b) for b in range(first, last + 1)]
+        values = np.concatenate(blocks)
+        offset = first * self.blocksize
+        return values[start - offset : stop - offset]
+
+    def blockRange(self, start, stop):
+        first = max(start, 0) // self.blocksize
+        last = (min(stop, self.nsamples) - 1) // self.blocksize
+        return range(first, last + 1)
+
+    def missingSummaries(self, start, stop):
+        # Blocks covering [start, stop) not decoded so far
+        return [b for b in self.blockRange(start, stop) if b not in self.summaries]
+
+    def summary(self, start, stop):
+        # Min and max of chunks of summarysize samples covering [start, stop),
+        # from the blocks decoded so far. Returns the chunk start positions,
+        # their mins and maxs.
+        starts, mins, maxs = [], [], []
+        for b in self.blockRange(start, stop):
+            if b not in self.summaries:
+                continue
+            bmins, bmaxs = self.summaries[b]
+            starts.append(b * self.blocksize + np.arange(len(bmins)) * self.summarysize)
+            mins.append(bmins)
+            maxs.append(bmaxs)
+        if not starts:
+            return (np.empty(0, dtype=np.int64), np.empty(0), np.empty(0))
+        return (np.concatenate(starts), np.concatenate(mins), np.concatenate(maxs))
+
+    def iterBlocks(self):
+        # Values of the consecutive blocks, to process the channel by parts
+        for b in range(self.nblocks):
+            yield self.block(b)
+
+    def series(self):
+        index = self.timestamps(np.arange(self.nsamples))
+        with self.opened() as edf:
+            values = edf.readSignal(self.channel)
+        return pd.Series(values, index=index, name=self.name)
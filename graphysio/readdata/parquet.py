@@ -1,10 +1,12 @@
+from datetime import datetime
+
 import numpy as np
 import pandas as pd
 import pyarrow.parquet as pa
 
-from graphysio.dialogs import DlgListChoice
+from graphysio.dialogs import DlgListChoice, askUserValue, userConfirm
 from graphysio.readdata.baseclass import BaseReader
-from graphysio.structures import PlotData
+from graphysio.structures import Parameter, PlotData
 
 
 class ParquetReader(BaseReader):
@@ -20,12 +22,95 @@ class ParquetReader(BaseReader):
         dlgchoice.dlgdata.connect(cb)
         dlgchoice.exec_()
 
+        if userConfirm('Only load a time range?', 'Open Parquet'):
+            begin = askUserValue(Parameter('Begin', datetime))
+            end = askUserValue(Parameter('End', datetime))
+            self.userdata['begin'] = begin
+            self.userdata['end'] = end
+
     def __call__(self) -> PlotData:
         filepath = self.userdata['filepath']
-        data = pd.read_parquet(filepath, columns=self.userdata['columns'])
+        begin = self.userdata.get('begin')
+        end = self.userdata.get('end')
+        begin = -np.inf if begin is None else begin
+        end = np.inf if end is None else end
+
+        pf = pa.ParquetFile(filepath)
+        indexpos = indexPosition(pf)
+        groups = list(range(pf.num_row_groups))
+        if indexpos is not None:
+            groups = [
+                i
+                for i in groups
+                if overlaps(pf.metadata.row_group(i), indexpos, begin, end)
+            ]
+        table = pf.read_row_groups(
+            groups, columns=self.userdata['columns'], use_pandas_metadata=True
+        )
+        data = table.to_pandas()
 
         data = data.dropna(axis='columns', how='all')
-        data = data.sort_index()
         data.index = data.index.astype(np.int64)
+        if np.isfinite(begin) or np.isfinite(end):
+            data = data[(data.index >= begin) & (data.index <= end)]
+        ordered = indexpos is not None and isOrdered(pf, groups, indexpos)
+        if not ordered and not data.index.is_monotonic_increasing:
+            data = data.sort_index()
 
         return PlotData(data=data, filepath=filepath)
+
+
+def indexPosition(pf):
+    # Column position of the stored pandas index, None if there is none
+    metadata = pf.schema_arrow.pandas_metadata
+    if not metadata:
+        return None
+    indexcols = metadata.get('index_columns', [])
+    if len(indexcols) != 1 or not isinstance(indexcols[0], str):
+        # RangeIndex or MultiIndex
+        return None
+    pos = pf.schema_arrow.get_field_index(indexcols[0])
+    return pos if pos >= 0 else None
+
+
+def statsBounds(rowgroup, pos):
+    stats = rowgroup.column(pos).statistics
+    if stats is None or not stats.has_min_max:
+        return None
+    bounds = []
+    for value in (stats.min, stats.max):
+        if isinstance(value, (int, np.integer)):
+            bounds.append(int(value))
+        else:
+            bounds.append(pd.Timestamp(value).value)
+    return bounds
+
+
+def overlaps(rowgroup, pos, begin, end):
+    bounds = statsBounds(rowgroup, pos)
+    if bounds is None:
+        return True
+    rgmin, rgmax = bounds
+    return rgmax >= begin and rgmin <= end
+
+
+def isOrdered(pf, groups, pos):
+    # True if the metadata guarantees that the selected row groups are each
+    # sorted on the index and do not overlap each other.
+    lastmax = None
+    for i in groups:
+        rowgroup = pf.metadata.row_group(i)
+        sortcols = getattr(rowgroup, 'sorting_columns', None)
+        if not sortcols:
+            return False
+        first = sortcols[0]
+        if first.column_index != pos or first.descending:
+            return False
+        bounds = statsBounds(rowgroup, pos)
+        if bounds is None:
+            return False
+        rgmin, rgmax = bounds
+        if lastmax is not None and rgmin < lastmax:
+            return False
+        lastmax = rgmax
+    return True
@@ -0,0 +1,223 @@
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Fixed width strptime directives and their width
+DIRECTIVES = {'%Y': 4, '%m': 2, '%d': 2, '%H': 2, '%M': 2, '%S': 2}
+# Layouts tried for <infer>, they are unambiguous
+INFER_FORMATS = [
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%d %H:%M:%S,%f',
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+]
+MAXFRACDIGITS = 9
+DAYSINMONTH = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+@lru_cache(maxsize=None)
+def compileFormat(dtformat):
+    # Split a strptime format into fixed width fields and literal characters.
+    # %f is only supported at the end. Returns None for other formats.
+    fields = {}
+    literals = []
+    offset = 0
+    i = 0
+    hasfrac = False
+    while i < len(dtformat):
+        if hasfrac:
+            return None
+        token = dtformat[i : i + 2]
+        if token in DIRECTIVES:
+            if token in fields:
+                return None
+            fields[token] = (offset, DIRECTIVES[token])
+            offset += DIRECTIVES[token]
+            i += 2
+        elif token == '%f':
+            hasfrac = True
+            i += 2
+        elif dtformat[i] == '%' or ord(dtformat[i]) > 127:
+            return None
+        else:
+            literals.append((offset, ord(dtformat[i])))
+            offset += 1
+            i += 1
+    return (fields, literals, offset, hasfrac)
+
+
+def parseFixedWidth(strings, dtformat) -> Optional[np.ndarray]:
+    # Parse strings to naive int64 nanoseconds. Returns None if the format is
+    # not supported or if any string does not strictly match it.
+    layout = compileFormat(dtformat)
+    if layout is None:
+        return None
+    fields, literals, width, hasfrac = layout
+    maxwidth = width + MAXFRACDIGITS if hasfrac else width
+    try:
+        raw = np.asarray(strings).astype(f'S{maxwidth + 1}')
+    except (UnicodeEncodeError, ValueError):
+        return None
+    if len(raw) < 1:
+        return None
+    # Only keep the characters we need to look at, one row per position in
+    # the strings. Strings have no embedded NUL, only NUL padding at the end.
+    positions = {offset for offset, _ in literals}
+    for offset, ndigits in fields.values():
+        positions.update(range(offset, offset + ndigits))
+    if hasfrac:
+        positions.update(range(width, maxwidth + 1))
+    else:
+        positions.update([width - 1, width])
+    positions = sorted(positions)
+    row = {position: n for n, position in enumerate(positions)}
+    chars = raw.view(np.uint8).reshape(len(raw), -1)[:, positions]
+    chars = np.ascontiguousarray(chars.T)
+
+    if hasfrac:
+        badlength = (chars[row[width]] == 0) | (chars[row[maxwidth]] != 0)
+    else:
+        badlength = (chars[row[width - 1]] == 0) | (chars[row[width]] != 0)
+    if np.any(badlength):
+        return None
+
+    for offset, char in literals:
+        if np.any(chars[row[offset]] != char):
+            return None
+
+    def number(offset, ndigits):
+        value = np.zeros(len(raw), dtype=np.int32)
+        for position in range(offset, offset + ndigits):
+            # Non digit characters wrap around to values above 9
+            digit = chars[row[position]] - np.uint8(ord('0'))
+            if np.any(digit > 9):
+                raise ValueError
+            value *= 10
+            value += digit
+        return value
+
+    try:
+        values = {name: number(*field) for name, field in fields.items()}
+        if hasfrac:
+            # Missing fraction digits are NUL padding, count them as zeros
+            for position in range(width, maxwidth):
+                padding = chars[row[position]] == 0
+                chars[row[position], padding] = ord('0')
+            frac = number(width, MAXFRACDIGITS)
+        else:
+            frac = 0
+    except ValueError:
+        return None
+
+    # Same defaults as strptime
+    year = values.get('%Y', 1900)
+    month = values.get('%m', 1)
+    day = values.get('%d', 1)
+    days = daysFromDates(year * 10000 + month * 100 + day)
+    if days is None:
+        return None
+
+    hour = values.get('%H', 0)
+    minute = values.get('%M', 0)
+    second = values.get('%S', 0)
+    if np.any((hour > 23) | (minute > 59) | (second > 59)):
+        return None
+    seconds = days * 86400 + (hour * 3600 + minute * 60 + second)
+    return seconds * 1_000_000_000 + frac
+
+
+def daysFromDates(dates):
+    # Days since 1970-01-01 of dates encoded as yyyymmdd. Recordings span few
+    # distinct dates, compute them on a lookup table of the covered range.
+    dates = np.asarray(dates)
+    first = int(dates.min())
+    last = int(dates.max())
+    if last - first > 10 ** 6:
+        table = None
+        lookup = dates
+    else:
+        table = np.arange(first, last + 1)
+        lookup = table
+    year, monthday = np.divmod(lookup, 10000)
+    month, day = np.divmod(monthday, 100)
+    isleap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    valid = (month >= 1) & (month <= 12)
+    monthlen = DAYSINMONTH[np.clip(month, 0, 12)] + (isleap & (month == 2))
+    valid &= (day >= 1) & (day <= monthlen)
+    days = daysFromCivil(year, month, day)
+    if table is not None:
+        valid = valid[dates - first]
+        days = days[dates - first]
+    if not np.all(valid):
+        return None
+    return days.astype(np.int64)
+
+
+def daysFromCivil(year, month, day):
+    # Days since 1970-01-01 of a proleptic Gregorian date
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def parseInfer(strings) -> Optional[np.ndarray]:
+    for dtformat in INFER_FORMATS:
+        parsed = parseFixedWidth(strings[:1], dtformat)
+        if parsed is not None:
+            return parseFixedWidth(strings, dtformat)
+    return None
+
+
+def utcOffsets(utcns, timezone):
+    local = pd.DatetimeIndex(utcns, tz='UTC').tz_convert(timezone)
+    return local.tz_localize(None).asi8 - utcns
+
+
+def tzTransitions(begin, end, timezone):
+    # UTC instants at which the offset of timezone changes between begin and
+    # end, and the offsets in effect before the first and after each of them.
+    step = 15 * 60 * 10 ** 9
+    grid = np.arange(begin - begin % step, end + step, step, dtype=np.int64)
+    offsets = utcOffsets(grid, timezone)
+    (changes,) = np.nonzero(np.diff(offsets))
+    transitions = []
+    for change in changes:
+        # Transitions happen on whole seconds
+        seconds = np.arange(grid[change], grid[change + 1] + 1, 10 ** 9)
+        secoffsets = utcOffsets(seconds, timezone)
+        (first,) = np.nonzero(secoffsets != secoffsets[0])
+        transitions.append(seconds[first[0]])
+    transitions = np.array(transitions, dtype=np.int64)
+    segoffsets = np.append(offsets[0], offsets[changes + 1])
+    return (transitions, segoffsets)
+
+
+def localToUtc(wallns, timezone) -> np.ndarray:
+    # Vectorized equivalent of tz_localize(timezone).tz_convert('UTC') using a
+    # table of the offset transitions. Ambiguous or non-existent wall times
+    # are handed over to pandas which raises the appropriate error.
+    wallns = np.asarray(wallns, dtype=np.int64)
+    if len(wallns) < 1:
+        return wallns
+    day = 24 * 3600 * 10 ** 9
+    transitions, offsets = tzTransitions(
+        wallns.min() - day, wallns.max() + day, timezone
+    )
+    # Wall time ranges of each constant offset segment
+    wallstarts = np.append(np.iinfo(np.int64).min, transitions + offsets[1:])
+    wallends = np.append(transitions + offsets[:-1], np.iinfo(np.int64).max)
+    if np.all(np.diff(wallstarts[1:]) > 0):
+        segment = np.searchsorted(wallstarts, wallns, side='right') - 1
+        nonexistent = wallns >= wallends[segment]
+        previousend = np.append(np.iinfo(np.int64).min, wallends[:-1])
+        ambiguous = wallns < previousend[segment]
+        if not np.any(nonexistent | ambiguous):
+            return wallns - offsets[segment]
+    utc = pd.DatetimeIndex(wallns).tz_localize(timezone).tz_convert('UTC')
+    return utc.asi8
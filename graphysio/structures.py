@@ -22,10 +22,12 @@ class CycleId(Enum):
 
 
 class PlotData:
-    def __init__(self, data=[], filepath="", name=None):
+    def __init__(self, data=[], filepath="", name=None, samplerates=None):
         self.data = data
         self.filepath = filepath
         self._name = name
+        # Known sample rates by series name, estimated from the data otherwise
+        self.samplerates = {} if samplerates is None else samplerates
 
     @property
     def name(self):
@@ -35,8 +35,9 @@ def loadUiFile(uiFile):
     return loadUiType(uiPath)
 
 
-def estimateSampleRate(series):
-    intervals = np.diff(series.index)
+def estimateSampleRate(series, intervals=None):
+    if intervals is None:
+        intervals = np.diff(series.index)
     # 1e9 to account for ns -> Hz
     fs = 1e9 / np.median(intervals)
     if fs == np.inf: